@@ -0,0 +1,330 @@
+import io
+import logging
+import os
+import subprocess
+import tempfile
+import wave
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import BinaryIO, List, Union
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.utils import get_encoder_name
+
+WAV_CHUNK_FRAMES = 64 * 1024
+
+# Speech is normalized to a gated RMS level, roughly the -16 LUFS that
+# podcast platforms expect, with the peaks kept below the ceiling.
+LOUDNESS_TARGET_DB = float(os.environ.get("LOUDNESS_TARGET_DB", "-16"))
+LOUDNESS_PEAK_DB = -1.0
+LOUDNESS_BLOCK_SECONDS = 0.4
+LOUDNESS_ABSOLUTE_GATE_DB = -70.0
+LOUDNESS_RELATIVE_GATE_DB = -10.0
+
+# Used when nothing has set the PCM format of an episode yet.
+DEFAULT_PCM_FORMAT = (24000, 1, 2)
+
+ENCODER_CODEC = os.environ.get("ENCODER_CODEC")
+ENCODER_BITRATE = os.environ.get("ENCODER_BITRATE")
+ENCODER_VBR_QUALITY = os.environ.get("ENCODER_VBR_QUALITY")
+ENCODER_MONO = os.environ.get("ENCODER_MONO", "True").lower() == "true"
+
+# codec -> (ffmpeg encoder, container format, default bitrate)
+CODECS = {
+    "mp3": ("libmp3lame", "mp3", "64k"),
+    "aac": ("aac", "adts", "64k"),
+    "opus": ("libopus", "ogg", "32k"),
+}
+# file extension -> (codec, container format)
+EXTENSION_FORMATS = {
+    ".mp3": ("mp3", "mp3"),
+    ".aac": ("aac", "adts"),
+    ".m4a": ("aac", "ipod"),
+    ".opus": ("opus", "ogg"),
+    ".ogg": ("opus", "ogg"),
+}
+
+
+@dataclass
+class EncoderSettings:
+    """How the episode is encoded. Speech needs far less than music defaults."""
+
+    codec: str = "mp3"
+    bitrate: str = None
+    # Encoder-specific VBR quality, e.g. 0-9 for LAME. Overrides the bitrate
+    # for mp3 and aac, opus uses VBR around its bitrate.
+    vbr_quality: str = None
+    mono: bool = ENCODER_MONO
+    sample_rate: int = None
+    # The file is read, e.g. uploaded, while it is being written. Muxers must
+    # not seek back to fill in a header at the end, the reader has already
+    # sent the stale one.
+    streamable: bool = False
+    # The codec's default container if None.
+    container: str = None
+
+    def __post_init__(self):
+        if self.codec not in CODECS:
+            raise ValueError(f"Unsupported codec: {self.codec}")
+
+    @classmethod
+    def for_file(cls, path: str, streamable: bool = False) -> "EncoderSettings":
+        """Settings from the environment, with the codec taken from the extension."""
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in EXTENSION_FORMATS:
+            raise ValueError(f"Unsupported audio file extension: {path}")
+        codec, container = EXTENSION_FORMATS[extension]
+        if ENCODER_CODEC and ENCODER_CODEC != codec:
+            codec, container = ENCODER_CODEC, None
+        return cls(
+            codec=codec,
+            bitrate=ENCODER_BITRATE,
+            vbr_quality=ENCODER_VBR_QUALITY,
+            streamable=streamable,
+            container=container,
+        )
+
+    @property
+    def format(self) -> str:
+        """The ffmpeg container format."""
+        return self.container or CODECS[self.codec][1]
+
+    def ffmpeg_args(self) -> List[str]:
+        encoder, _, default_bitrate = CODECS[self.codec]
+        args = ["-c:a", encoder]
+        if self.codec == "opus":
+            args += ["-b:a", self.bitrate or default_bitrate, "-vbr", "on"]
+        elif self.vbr_quality is not None and not (
+            self.streamable and self.codec == "mp3"
+        ):
+            args += ["-q:a", str(self.vbr_quality)]
+        else:
+            args += ["-b:a", self.bitrate or default_bitrate]
+        if self.streamable and self.codec == "mp3":
+            # The Xing/LAME header is rewritten at the end, leave it out. Its
+            # duration and seek table are why VBR is off here, CBR needs none.
+            args += ["-write_xing", "0"]
+        if self.streamable and self.format in ("ipod", "mp4"):
+            # The index goes up front, the samples follow in fragments.
+            args += ["-movflags", "+empty_moov+default_base_moof"]
+            args += ["-frag_duration", str(10 * 1000000)]
+        if self.mono:
+            args += ["-ac", "1"]
+        if self.sample_rate:
+            args += ["-ar", str(self.sample_rate)]
+        return args + ["-f", self.format]
+
+
+def normalize_wav(
+    audio_data: bytes,
+    target_db: float = LOUDNESS_TARGET_DB,
+    peak_db: float = LOUDNESS_PEAK_DB,
+) -> bytes:
+    """Scale 16-bit WAV bytes to the target loudness, other formats pass through.
+
+    The level is the mean power of 400 ms blocks above an absolute and a
+    relative gate, as in EBU R128 but without its K-weighting filter, so
+    pauses do not make a segment louder.
+    """
+    with wave.open(io.BytesIO(audio_data), "rb") as wav:
+        params = (wav.getframerate(), wav.getnchannels(), wav.getsampwidth())
+        frames = wav.readframes(wav.getnframes())
+    frame_rate, channels, sample_width = params
+    if sample_width != 2 or not frames:
+        return audio_data
+
+    samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768.0
+    level = _gated_level(samples.reshape(-1, channels).mean(axis=1), frame_rate)
+    if level is None:
+        return audio_data
+    peak = float(np.abs(samples).max())
+    gain_db = min(target_db - level, peak_db - 20 * np.log10(peak))
+    samples *= 10 ** (gain_db / 20)
+    frames = (np.clip(samples, -1.0, 1.0 - 1 / 32768) * 32768.0).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setframerate(frame_rate)
+        wav.setnchannels(channels)
+        wav.setsampwidth(sample_width)
+        wav.writeframes(frames.tobytes())
+    return buffer.getvalue()
+
+
+def _gated_level(samples: np.ndarray, frame_rate: int) -> Union[float, None]:
+    """Return the gated level of mono samples in dBFS, None for silence."""
+    block = max(int(frame_rate * LOUDNESS_BLOCK_SECONDS), 1)
+    num_blocks = len(samples) // block
+    if num_blocks:
+        blocks = samples[: num_blocks * block].reshape(num_blocks, block)
+        power = np.square(blocks).mean(axis=1)
+    else:
+        power = np.square(samples).mean(keepdims=True)
+    power = power[power > 10 ** (LOUDNESS_ABSOLUTE_GATE_DB / 10)]
+    if not power.size:
+        return None
+    power = power[power > power.mean() * 10 ** (LOUDNESS_RELATIVE_GATE_DB / 10)]
+    return 10 * float(np.log10(power.mean()))
+
+
+@lru_cache(maxsize=32)
+def silence(num_frames: int, channels: int, sample_width: int) -> bytes:
+    # 8-bit PCM is unsigned, its silence is 128 rather than 0.
+    fill = b"\x80" if sample_width == 1 else b"\0"
+    return fill * (num_frames * channels * sample_width)
+
+
+@lru_cache(maxsize=8)
+def load_jingle(
+    path: str, frame_rate: int, channels: int, sample_width: int
+) -> bytes:
+    """Decode a jingle once per process, as raw PCM in the given format."""
+    logging.info("Decoding jingle: %s", path)
+    segment = (
+        AudioSegment.from_file(path)
+        .set_frame_rate(frame_rate)
+        .set_channels(channels)
+        .set_sample_width(sample_width)
+    )
+    return segment.raw_data
+
+
+class AudioAssembler:
+    """Concatenate segments into one encoded file through a single ffmpeg pipe.
+
+    Segments are streamed to the encoder as raw PCM as they are appended, so
+    earlier segments are never copied again and memory use does not grow with
+    the length of the episode. The PCM format is taken from the first segment;
+    later segments in a different format are converted before being written.
+    Silence and jingles appended before the first segment wait for its format.
+    """
+
+    def __init__(self, output_file: str, encoder: EncoderSettings = None):
+        self.output_file = output_file
+        self.encoder = encoder or EncoderSettings.for_file(output_file)
+        self.frame_rate = None
+        self.channels = None
+        self.sample_width = None
+        self._process = None
+        self._stderr = None
+        # (method, argument) appended before the PCM format was known.
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def append_wav(self, source: Union[str, BinaryIO]):
+        """Append a WAV segment, given as a path or a binary file object."""
+        with wave.open(source, "rb") as wav:
+            if self._process is None:
+                self._start(wav.getframerate(), wav.getnchannels(), wav.getsampwidth())
+            if (
+                wav.getframerate(),
+                wav.getnchannels(),
+                wav.getsampwidth(),
+            ) != (self.frame_rate, self.channels, self.sample_width):
+                logging.debug("Converting segment to the episode format: %s", source)
+                if not isinstance(source, str):
+                    source.seek(0)
+                self.append_segment(AudioSegment.from_wav(source))
+                return
+            while True:
+                frames = wav.readframes(WAV_CHUNK_FRAMES)
+                if not frames:
+                    break
+                self._process.stdin.write(frames)
+
+    def append_silence(self, seconds: float):
+        if self._process is None:
+            self._pending.append((self.append_silence, seconds))
+            return
+        num_frames = int(seconds * self.frame_rate)
+        self._process.stdin.write(silence(num_frames, self.channels, self.sample_width))
+
+    def append_jingle(self, path: str):
+        """Append an audio file of any format, decoded once per process."""
+        if self._process is None:
+            self._pending.append((self.append_jingle, path))
+            return
+        self._process.stdin.write(
+            load_jingle(path, self.frame_rate, self.channels, self.sample_width)
+        )
+
+    def append_segment(self, segment: AudioSegment):
+        if self._process is None:
+            self._start(segment.frame_rate, segment.channels, segment.sample_width)
+        segment = (
+            segment.set_frame_rate(self.frame_rate)
+            .set_channels(self.channels)
+            .set_sample_width(self.sample_width)
+        )
+        self._process.stdin.write(segment.raw_data)
+
+    def close(self):
+        if self._process is None and self._pending:
+            self._start(*DEFAULT_PCM_FORMAT)
+        if self._process is None:
+            AudioSegment.empty().export(
+                self.output_file,
+                format=self.encoder.format,
+                parameters=self.encoder.ffmpeg_args(),
+            )
+            return
+        process, self._process = self._process, None
+        process.stdin.close()
+        returncode = process.wait()
+        self._stderr.seek(0)
+        stderr = self._stderr.read()
+        self._stderr.close()
+        if returncode != 0:
+            raise RuntimeError(
+                "Encoding {} failed: {}".format(
+                    self.output_file, stderr.decode(errors="replace")
+                )
+            )
+
+    def abort(self):
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        process.kill()
+        process.wait()
+        self._stderr.close()
+
+    def _start(self, frame_rate: int, channels: int, sample_width: int):
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        command = [
+            get_encoder_name(),
+            "-y",
+            "-f",
+            "s{}le".format(sample_width * 8) if sample_width > 1 else "u8",
+            "-ar",
+            str(frame_rate),
+            "-ac",
+            str(channels),
+            "-i",
+            "pipe:0",
+            *self.encoder.ffmpeg_args(),
+            self.output_file,
+        ]
+        logging.debug("Starting encoder: %s", " ".join(command))
+        # A file rather than a pipe, so a chatty encoder cannot block on stderr
+        # while we are blocked writing to its stdin.
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=self._stderr,
+        )
+        pending, self._pending = self._pending, []
+        for append, argument in pending:
+            append(argument)
@@ -0,0 +1,186 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List
+
+import requests
+
+from audio import EncoderSettings
+from cache import SingleFlight
+from composer import TTS_CONCURRENCY, Composer
+from crawler.base import PARSE_NUM_WORKERS, PARSE_TIMEOUT
+from crawler.hackernews import HackerNewsCrawler
+from crawler.index import CrawlIndex
+from crawler.sample import SampleCrawler
+from crawler.wsj import WSJCrawler
+from dedup import Deduplicator
+from dtos import Article
+from metrics import METRICS
+from pipeline import Pipeline
+from podcast.castos import CastosPodcast
+from summary import SUMMARY_NUM_WORKERS, OpenAISummarizer
+from text_to_speech import TextToSpeech
+
+BATCH_FEED_WORKERS = 2
+
+CRAWLERS = {
+    "hackernews": HackerNewsCrawler,
+    "wsj": WSJCrawler,
+    "sample": SampleCrawler,
+}
+
+
+@dataclass
+class FeedConfig:
+    name: str
+    crawler: str = "hackernews"
+    max_stories: int = 10
+    max_summaries: int = 10
+    podcast_id: str = None
+    data_dir: str = "data"
+
+
+def load_feeds(path: str) -> List[FeedConfig]:
+    """Read feeds from a JSON file of the form {"feeds": [{"name": ...}, ...]}."""
+    with open(path) as f:
+        feeds = [FeedConfig(**feed) for feed in json.load(f)["feeds"]]
+    names = set()
+    for feed in feeds:
+        if feed.crawler not in CRAWLERS:
+            raise ValueError(f"Unknown crawler for feed {feed.name}: {feed.crawler}")
+        if feed.name in names:
+            raise ValueError(f"Duplicate feed name: {feed.name}")
+        names.add(feed.name)
+    return feeds
+
+
+class SharedSummarizer:
+    """Summarize each URL once, however many feeds it shows up in."""
+
+    def __init__(self, summarizer: OpenAISummarizer):
+        self.summarizer = summarizer
+        self._summaries = SingleFlight()
+
+    def summarize_article(self, article: Article) -> bool:
+        summary = self._summaries.get(article.url, lambda: self._summarize(article))
+        if summary is None:
+            return False
+        article.summary = summary
+        return True
+
+    def _summarize(self, article: Article):
+        if not self.summarizer.summarize_article(article):
+            return None
+        return article.summary
+
+
+class BatchRunner:
+    """Run several feeds in one process, sharing what is costly to set up.
+
+    The parser and its browser pool, the HTTP session, the crawl index, the
+    summarizer with its tokenizer, rate limiter and cache, and the TTS client
+    with its cache are created once for all feeds. A URL that is in several
+    feeds is fetched and summarized once, while repeated stories within a
+    feed are dropped. A feed that fails is logged and reported, the other
+    feeds carry on.
+    """
+
+    def __init__(
+        self,
+        parser,
+        summarizer: OpenAISummarizer,
+        tts: TextToSpeech,
+        session: requests.Session,
+        index: CrawlIndex = None,
+        podcast: CastosPodcast = None,
+        parse_workers: int = PARSE_NUM_WORKERS,
+        parse_timeout: float = PARSE_TIMEOUT,
+        summary_workers: int = SUMMARY_NUM_WORKERS,
+        concurrency: int = TTS_CONCURRENCY,
+        feed_workers: int = BATCH_FEED_WORKERS,
+        output_dir: str = ".",
+    ):
+        self.parser = parser
+        self.summarizer = SharedSummarizer(summarizer)
+        self.tts = tts
+        self.session = session
+        self.index = index
+        self.podcast = podcast
+        self.parse_workers = parse_workers
+        self.parse_timeout = parse_timeout
+        self.summary_workers = summary_workers
+        self.concurrency = concurrency
+        self.feed_workers = feed_workers
+        self.output_dir = output_dir
+        self._pages = SingleFlight()
+
+    def run(self, feeds: List[FeedConfig], date: datetime) -> Dict[str, str]:
+        """Run all feeds, return the error of each feed that failed by name."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        errors = {}
+        with ThreadPoolExecutor(max_workers=self.feed_workers) as executor:
+            futures = {
+                feed.name: executor.submit(self.run_feed, feed, date) for feed in feeds
+            }
+            for name, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.exception("Feed failed: %s", name)
+                    METRICS.incr("feed_failures")
+                    errors[name] = repr(e)
+        return errors
+
+    def run_feed(self, feed: FeedConfig, date: datetime):
+        audio_output = os.path.join(self.output_dir, f"{feed.name}.mp3")
+        note_output = os.path.join(self.output_dir, f"{feed.name}.txt")
+        publishing = feed.podcast_id is not None and self.podcast is not None
+        pipeline = Pipeline(
+            self.create_crawler(feed),
+            self.summarizer,
+            Composer(
+                feed.name,
+                date,
+                feed.data_dir,
+                tts=self.tts,
+                concurrency=self.concurrency,
+                encoder=EncoderSettings.for_file(audio_output, streamable=publishing),
+            ),
+            summary_workers=self.summary_workers,
+        )
+
+        def compose_episode():
+            pipeline.run(
+                feed.max_stories,
+                feed.max_summaries,
+                output_file=audio_output,
+                note_file=note_output,
+            )
+
+        if not publishing:
+            compose_episode()
+            return
+        self.podcast.publish_while_writing(
+            feed.podcast_id,
+            date.strftime("%A, %B %d"),
+            note_output,
+            audio_output,
+            compose_episode,
+        )
+
+    def create_crawler(self, feed: FeedConfig):
+        kwargs = dict(
+            num_workers=self.parse_workers,
+            parse_timeout=self.parse_timeout,
+            index=self.index,
+            session=self.session,
+            pages=self._pages,
+            dedup=Deduplicator(),
+        )
+        if feed.crawler == "wsj":
+            # The WSJ front page is loaded in the browser pool of the parser.
+            kwargs["pool"] = getattr(self.parser, "browser_parser", self.parser).pool
+        return CRAWLERS[feed.crawler](self.parser, **kwargs)
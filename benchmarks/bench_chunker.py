@@ -0,0 +1,94 @@
+"""Compare the token-offset chunker with the previous recursive chunker.
+
+    OPENAI_MOCK=true python -m benchmarks.bench_chunker --paragraphs 200
+"""
+import random
+import time
+
+import click
+from transformers import GPT2TokenizerFast
+
+from benchmarks.fakes import WORDS
+from summary import OpenAISummarizer
+
+
+def make_article(num_paragraphs, rng):
+    paragraphs = []
+    for _ in range(num_paragraphs):
+        sentences = []
+        for _ in range(rng.randint(2, 60)):
+            words = rng.choices(WORDS, k=rng.randint(5, 30))
+            sentences.append(" ".join(words).capitalize())
+        paragraphs.append(". ".join(sentences) + ".")
+    return paragraphs
+
+
+class LegacyChunker:
+    """The recursive chunker that re-tokenized text at every level."""
+
+    def __init__(self, tokenizer, max_length):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+
+    def break_down_text(self, text):
+        text_len = self.tokenizer(text, return_length=True).length[0]
+        if text_len > self.max_length:
+            separator = ". "
+            splits = text.split(". ")
+            if len(splits) == 1:
+                splits = text.split(" ")
+                separator = " "
+            mid = len(splits) // 2
+            first = separator.join(splits[:mid])
+            second = separator.join(splits[mid:])
+            return self.break_down_text(first) + self.break_down_text(second)
+        else:
+            return [text]
+
+    def get_chunks(self, text_list):
+        breakdown_chunk_list = []
+        for text in text_list:
+            breakdown_chunk_list += self.break_down_text(text)
+        merged_chunk_list = []
+        chunk = ""
+        current_length = 0
+        for text in breakdown_chunk_list:
+            text_len = self.tokenizer(text, return_length=True).length[0]
+            if current_length + text_len > self.max_length:
+                merged_chunk_list.append(chunk)
+                chunk = ""
+                current_length = 0
+            chunk += " " + text
+            current_length += text_len
+        if chunk:
+            merged_chunk_list.append(chunk)
+        return merged_chunk_list
+
+
+def timed(chunker, articles):
+    start = time.perf_counter()
+    num_chunks = sum(len(chunker.get_chunks(article)) for article in articles)
+    return time.perf_counter() - start, num_chunks
+
+
+@click.command()
+@click.option("--articles", default=5)
+@click.option("--paragraphs", default=200)
+@click.option("--seed", default=0)
+def main(articles, paragraphs, seed):
+    rng = random.Random(seed)
+    corpus = [make_article(paragraphs, rng) for _ in range(articles)]
+    tokenizer = GPT2TokenizerFast.from_pretrained("gpt2")
+    summarizer = OpenAISummarizer(tokenizer=tokenizer)
+    legacy = LegacyChunker(tokenizer, summarizer.max_length)
+
+    for name, chunker in [("legacy", legacy), ("offsets", summarizer)]:
+        elapsed, num_chunks = timed(chunker, corpus)
+        print(f"{name:8s} {elapsed:8.3f}s {num_chunks:6d} chunks")
+    # A second pass over the same text is served from the token memo.
+    elapsed, num_chunks = timed(summarizer, corpus)
+    print(f"{'memo':8s} {elapsed:8.3f}s {num_chunks:6d} chunks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Measure the precision, recall and speed of near-duplicate detection.
+
+The synthetic corpus has original stories, edited copies of some of them
+(reworded words, dropped paragraphs, added boilerplate, tracking parameters
+in the URL) and unrelated stories on the same topic that share a lead
+paragraph. Stories are checked in a shuffled rank order, as a crawl would.
+
+    python -m benchmarks.bench_dedup --sizes 100,1000,5000
+"""
+import random
+import time
+
+import click
+
+from dedup import DEDUP_THRESHOLD, Deduplicator, shingle_hashes
+from dtos import Article
+
+
+def make_vocabulary(size, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choices(letters, k=rng.randint(2, 9))) for _ in range(size)]
+
+
+def make_story(vocabulary, rng):
+    return [
+        " ".join(rng.choices(vocabulary, k=rng.randint(40, 120)))
+        for _ in range(rng.randint(4, 15))
+    ]
+
+
+def make_copy(text_list, vocabulary, edit_rate, rng):
+    """Reword a share of the words, drop a paragraph and add boilerplate."""
+    paragraphs = [
+        " ".join(
+            rng.choice(vocabulary) if rng.random() < edit_rate else word
+            for word in paragraph.split()
+        )
+        for paragraph in text_list
+    ]
+    if len(paragraphs) > 4 and rng.random() < 0.5:
+        paragraphs.pop(rng.randrange(len(paragraphs)))
+    return paragraphs + ["Subscribe to our newsletter for more stories like this."]
+
+
+def make_corpus(size, dup_rate, edit_rate, rng):
+    """Return (article, group) pairs, stories of a group are copies of each other."""
+    vocabulary = make_vocabulary(20000, rng)
+    corpus = []
+    originals = []
+    while len(corpus) < size:
+        roll = rng.random()
+        if originals and roll < dup_rate:
+            group, url, text_list = rng.choice(originals)
+            if rng.random() < 0.3:
+                url += "?utm_source=hn&utm_medium=social"
+            else:
+                url = f"https://mirror{len(corpus)}.example.com/story"
+            text_list = make_copy(text_list, vocabulary, edit_rate, rng)
+        else:
+            group = len(originals)
+            url = f"https://news{group}.example.com/story/{group}"
+            text_list = make_story(vocabulary, rng)
+            if originals and roll < dup_rate * 2:
+                # Same event, written independently: only the lead is shared.
+                text_list[0] = rng.choice(originals)[2][0]
+            originals.append((group, url, text_list))
+        corpus.append(
+            (
+                Article(
+                    source_name="bench",
+                    source_id=str(len(corpus)),
+                    source_rank=len(corpus),
+                    title=f"Story {len(corpus)}",
+                    url=url,
+                    text_list=text_list,
+                ),
+                group,
+            )
+        )
+    rng.shuffle(corpus)
+    return corpus
+
+
+def run_dedup(corpus, threshold):
+    dedup = Deduplicator(threshold=threshold)
+    groups = {}
+    predicted = []
+    start = time.perf_counter()
+    for article, group in corpus:
+        original = dedup.check_url(article) or dedup.check_text(article)
+        predicted.append(groups[original] if original else None)
+        groups.setdefault(article.url, group)
+    return predicted, time.perf_counter() - start
+
+
+def run_exact(corpus, threshold):
+    """Compare every story with every kept one, the quadratic baseline."""
+    kept = []
+    predicted = []
+    start = time.perf_counter()
+    for article, group in corpus:
+        shingles = shingle_hashes(article.text_list)
+        original = None
+        for other, other_group in kept:
+            if len(shingles & other) / len(shingles | other) >= threshold:
+                original = other_group
+                break
+        predicted.append(original)
+        if original is None:
+            kept.append((shingles, group))
+    return predicted, time.perf_counter() - start
+
+
+def score(corpus, predicted):
+    seen = set()
+    true_positives = false_positives = false_negatives = 0
+    for (_, group), original in zip(corpus, predicted):
+        is_duplicate = group in seen
+        seen.add(group)
+        if original is not None and original == group:
+            true_positives += 1
+        elif original is not None:
+            false_positives += 1
+        if is_duplicate and original != group:
+            false_negatives += 1
+    precision = true_positives / max(true_positives + false_positives, 1)
+    recall = true_positives / max(true_positives + false_negatives, 1)
+    return precision, recall
+
+
+@click.command()
+@click.option("--sizes", default="100,1000,5000")
+@click.option("--dup-rate", default=0.2, help="Share of stories that are copies.")
+@click.option("--edit-rate", default=0.1, help="Share of words changed in a copy.")
+@click.option("--threshold", default=DEDUP_THRESHOLD)
+@click.option("--exact-max", default=1000, help="Largest size to run exact on.")
+@click.option("--seed", default=0)
+def main(sizes, dup_rate, edit_rate, threshold, exact_max, seed):
+    print(
+        f"{'size':>6s} {'method':8s} {'seconds':>8s} {'us/story':>9s} "
+        "precision recall"
+    )
+    for size in [int(size) for size in sizes.split(",")]:
+        corpus = make_corpus(size, dup_rate, edit_rate, random.Random(seed))
+        methods = [("minhash", run_dedup)]
+        if size <= exact_max:
+            methods.append(("exact", run_exact))
+        for name, method in methods:
+            predicted, elapsed = method(corpus, threshold)
+            precision, recall = score(corpus, predicted)
+            print(
+                f"{size:6d} {name:8s} {elapsed:8.3f} {elapsed / size * 1e6:9.0f} "
+                f"{precision:9.3f} {recall:6.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
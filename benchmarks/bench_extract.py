@@ -0,0 +1,65 @@
+"""Compare the lxml fast path with readability on a saved corpus of pages.
+
+Reports the time per page of each extractor and how much of the readability
+text the fast path recovers (word overlap precision, recall and F1).
+
+    python -m benchmarks.bench_extract path/to/corpus  # a directory of *.html
+"""
+import glob
+import os
+import statistics
+import time
+from collections import Counter
+
+import click
+
+from extract import extract_text_list, readability_text_list
+
+
+def word_overlap(candidate, reference):
+    candidate_words = Counter(" ".join(candidate).lower().split())
+    reference_words = Counter(" ".join(reference).lower().split())
+    common = sum((candidate_words & reference_words).values())
+    precision = common / max(sum(candidate_words.values()), 1)
+    recall = common / max(sum(reference_words.values()), 1)
+    f1 = 2 * precision * recall / max(precision + recall, 1e-9)
+    return precision, recall, f1
+
+
+def timed(func, html):
+    start = time.perf_counter()
+    result = func(html)
+    return result, time.perf_counter() - start
+
+
+@click.command()
+@click.argument("corpus_dir")
+@click.option("--verbose", is_flag=True, help="Print every page.")
+def main(corpus_dir, verbose):
+    fast_times, readability_times, scores = [], [], []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, "*.html"))):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            html = f.read()
+        fast, fast_time = timed(extract_text_list, html)
+        reference, readability_time = timed(readability_text_list, html)
+        score = word_overlap(fast, reference)
+        fast_times.append(fast_time)
+        readability_times.append(readability_time)
+        scores.append(score)
+        if verbose:
+            print(
+                f"{os.path.basename(path):40s} {fast_time * 1000:8.1f}ms "
+                f"{readability_time * 1000:8.1f}ms f1={score[2]:.3f}"
+            )
+
+    if not scores:
+        raise click.ClickException(f"No .html files in {corpus_dir}")
+    print(f"pages        {len(scores)}")
+    print(f"fast         {statistics.median(fast_times) * 1000:8.1f}ms median")
+    print(f"readability  {statistics.median(readability_times) * 1000:8.1f}ms median")
+    for idx, name in enumerate(["precision", "recall", "f1"]):
+        print(f"{name:12s} {statistics.mean(s[idx] for s in scores):.3f} mean")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Run crawl, summary, compose and publish against local fakes and time each stage.
+
+Every size runs in its own process so that peak RSS is measured per size.
+Each stage reports its own item count and how much it grew the RSS. A stage
+that fails, e.g. compose when `--tts-error-rate` loses a clip, records its error.
+
+    python -m benchmarks.bench_pipeline --sizes 10,100,1000 --latency 0.05
+"""
+import datetime
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from benchmarks.fakes import FakeServices
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_mb() -> float:
+    # The second field of statm is the resident set, in pages.
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024**2
+
+
+def run_size(size, latency, error_rate, tts_latency, tts_error_rate, workers):
+    services = FakeServices(size, latency=latency, error_rate=error_rate).start()
+    # The service modules read their endpoints at import time.
+    os.environ["OPENAI_API_BASE"] = services.openai_api_base
+    os.environ["OPENAI_API_TOKEN"] = "fake"
+    os.environ["CASTOS_BASE_URL"] = services.castos_base_url
+    os.environ["CASTOS_API_TOKEN"] = "fake"
+
+    from composer import Composer
+    from crawler import HackerNewsCrawler
+    from metrics import METRICS
+    from podcast.castos import CastosPodcast
+    from summary import OpenAISummarizer, RateLimiter
+    from text_to_speech import FakeSpeechBackend, TextToSpeech
+    from webparser import SimpleParser
+
+    results = []
+
+    def stage(name, func, count=len):
+        """Time a stage, `count` gives the number of items it produced."""
+        start_rss = rss_mb()
+        start_peak = peak_rss_mb()
+        start = time.perf_counter()
+        error = None
+        try:
+            value = func()
+        except Exception as e:
+            value, error = None, repr(e)
+        elapsed = time.perf_counter() - start
+        items = 0 if error else count(value)
+        results.append(
+            {
+                "stage": name,
+                "error": error,
+                "seconds": elapsed,
+                "items": items,
+                "items_per_second": items / max(elapsed, 1e-9),
+                "rss_delta_mb": rss_mb() - start_rss,
+                "peak_rss_growth_mb": peak_rss_mb() - start_peak,
+            }
+        )
+        return value
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        crawler = HackerNewsCrawler(
+            SimpleParser(),
+            num_workers=workers,
+            topstories_url=services.hn_topstories_url,
+            item_url=services.hn_item_url,
+        )
+        articles = stage("crawl", lambda: crawler.get_articles(size))
+
+        with OpenAISummarizer(
+            rate_limiter=RateLimiter(workers, max_requests_per_minute=0)
+        ) as summarizer:
+            articles = stage(
+                "summary",
+                lambda: summarizer.summarize_articles(
+                    articles, size, max_workers=workers
+                ),
+            )
+
+        audio_path = os.path.join(tmp_dir, "output.mp3")
+        note_path = os.path.join(tmp_dir, "output.txt")
+        composer = Composer(
+            "bench",
+            datetime.datetime.now(),
+            tmp_dir,
+            tts=TextToSpeech(
+                backend=FakeSpeechBackend(
+                    latency=tts_latency, error_rate=tts_error_rate
+                )
+            ),
+            concurrency=workers,
+        )
+        stage(
+            "compose",
+            lambda: composer.compose(
+                articles, output_file=audio_path, note_file=note_path
+            ),
+            count=lambda _: len(articles),
+        )
+
+        stage(
+            "publish",
+            lambda: CastosPodcast().create_episode(
+                "bench", "Benchmark", note_path, audio_path
+            ),
+            count=lambda _: 1,
+        )
+
+    services.stop()
+    return {
+        "size": size,
+        "articles": len(articles),
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": results,
+        "metrics": METRICS.report(),
+    }
+
+
+@click.command()
+@click.option("--sizes", default="10,100,1000")
+@click.option("--latency", default=0.05, help="Seconds per fake HTTP response.")
+@click.option("--error-rate", default=0.0)
+@click.option("--tts-latency", default=0.2, help="Seconds per fake TTS request.")
+@click.option("--tts-error-rate", default=0.0, help="Share of failed TTS requests.")
+@click.option("--workers", default=8)
+@click.option("--single", is_flag=True, hidden=True)
+@click.option("--output", help="Write all results as JSON.")
+def main(
+    sizes, latency, error_rate, tts_latency, tts_error_rate, workers, single, output
+):
+    if single:
+        result = run_size(
+            int(sizes), latency, error_rate, tts_latency, tts_error_rate, workers
+        )
+        print(json.dumps(result))
+        return
+
+    all_results = []
+    for size in [int(s) for s in sizes.split(",")]:
+        proc = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.bench_pipeline",
+                "--single",
+                "--sizes",
+                str(size),
+                "--latency",
+                str(latency),
+                "--error-rate",
+                str(error_rate),
+                "--tts-latency",
+                str(tts_latency),
+                "--tts-error-rate",
+                str(tts_error_rate),
+                "--workers",
+                str(workers),
+            ],
+            check=True,
+            stdout=subprocess.PIPE,
+        )
+        result = json.loads(proc.stdout.decode().strip().splitlines()[-1])
+        all_results.append(result)
+        for stage in result["stages"]:
+            print(
+                f"{size:6d} {stage['stage']:8s} {stage['seconds']:9.3f}s "
+                f"{stage['items']:6d} {stage['items_per_second']:9.1f}/s "
+                f"{stage['rss_delta_mb']:+8.1f}MB {stage['peak_rss_growth_mb']:+8.1f}MB"
+            )
+            if stage["error"]:
+                print(f"{size:6d} {stage['stage']:8s} failed: {stage['error']}")
+        print(f"{size:6d} peak RSS {result['peak_rss_mb']:.1f}MB")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(all_results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
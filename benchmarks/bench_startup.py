@@ -0,0 +1,54 @@
+"""Measure CLI startup time, per subcommand.
+
+For every subcommand this times `main.py <command> --help`, which is what
+every invocation pays before doing any work, and the import of the modules
+the command loads when it runs.
+
+    python -m benchmarks.bench_startup --repeat 5
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMAND_IMPORTS = {
+    "crawl": "import crawler, webparser",
+    "summary": "import summary",
+    "compose": "import composer",
+    "publish": "import podcast.castos",
+}
+
+
+def run(args, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + args,
+            cwd=ROOT,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+@click.command()
+@click.option("--repeat", default=5)
+def main(repeat):
+    baseline = run(["-c", "pass"], repeat)
+    print(f"{'interpreter':12s} {baseline:8.3f}s")
+    for command, imports in COMMAND_IMPORTS.items():
+        cli = run(["main.py", command, "--help"], repeat)
+        body = run(["-c", imports], repeat)
+        print(f"{command:12s} {cli:8.3f}s cli {body:8.3f}s imports")
+
+
+if __name__ == "__main__":
+    main()
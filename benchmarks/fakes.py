@@ -0,0 +1,217 @@
+"""Local stand-ins for the services the pipeline talks to.
+
+A single threaded HTTP server plays Hacker News, the article sites, the
+OpenAI chat completion endpoint and the Castos API. Every response waits
+`latency` seconds and fails with probability `error_rate`, a 500 for most
+routes and a 429 rate limit error for OpenAI. The first `upload_failures`
+episode uploads also fail, and every upload is kept in `uploads`.
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "the of and to in is that for it as was with be by on not he this are or "
+    "his from at which but have an they you were her she there been one all "
+    "would their we him has when who will more no if out so said what up its"
+).split()
+
+
+def make_paragraphs(seed: int, num_paragraphs: int):
+    rng = random.Random(seed)
+    paragraphs = []
+    for _ in range(num_paragraphs):
+        sentences = [
+            " ".join(rng.choices(WORDS, k=rng.randint(5, 25))).capitalize()
+            for _ in range(rng.randint(3, 10))
+        ]
+        paragraphs.append(". ".join(sentences) + ".")
+    return paragraphs
+
+
+class FakeServices:
+    def __init__(
+        self,
+        num_stories: int,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        paragraphs_per_article: int = 20,
+        seed: int = 0,
+        upload_failures: int = 0,
+    ):
+        self.num_stories = num_stories
+        self.latency = latency
+        self.error_rate = error_rate
+        self.paragraphs_per_article = paragraphs_per_article
+        self.seed = seed
+        self.uploaded_bytes = 0
+        self.upload_failures = upload_failures
+        # (headers, body) of every episode upload, failed ones included.
+        self.uploads = []
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def hn_topstories_url(self) -> str:
+        return self.base_url + "/v0/topstories.json"
+
+    @property
+    def hn_item_url(self) -> str:
+        return self.base_url + "/v0/item/{}.json"
+
+    @property
+    def openai_api_base(self) -> str:
+        return self.base_url + "/v1"
+
+    @property
+    def castos_base_url(self) -> str:
+        return self.base_url + "/api/v2"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            return self._rng.random() < self.error_rate
+
+    def _route(self, method: str, path: str, body: bytes, headers=None):
+        """Return (status, content type, payload) for a request."""
+        time.sleep(self.latency)
+        if path == "/v0/topstories.json":
+            return 200, "application/json", list(range(1, self.num_stories + 1))
+
+        match = re.fullmatch(r"/v0/item/(\d+)\.json", path)
+        if match:
+            if self._should_fail():
+                return 500, "application/json", {"error": "fake failure"}
+            item_id = int(match.group(1))
+            return 200, "application/json", {
+                "id": item_id,
+                "type": "story",
+                "title": f"Story number {item_id}",
+                "url": f"{self.base_url}/articles/{item_id}",
+            }
+
+        match = re.fullmatch(r"/articles/(\d+)", path)
+        if match:
+            if self._should_fail():
+                return 500, "text/html", "<html><body>Server error</body></html>"
+            paragraphs = make_paragraphs(
+                self.seed + int(match.group(1)), self.paragraphs_per_article
+            )
+            html = "".join(f"<p>{p}</p>" for p in paragraphs)
+            return 200, "text/html", (
+                f"<html><head><title>Article {match.group(1)}</title></head>"
+                f"<body><nav>Home | About</nav><article><h1>Article</h1>{html}"
+                f"</article><footer>Copyright</footer></body></html>"
+            )
+
+        if method == "POST" and path == "/v1/chat/completions":
+            if self._should_fail():
+                return 429, "application/json", {
+                    "error": {"message": "Rate limit reached", "type": "requests"}
+                }
+            request = json.loads(body)
+            prompt = request["messages"][-1]["content"]
+            summary = " ".join(prompt.split()[2:60])
+            return 200, "application/json", {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": summary},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": len(prompt.split()),
+                    "completion_tokens": len(summary.split()),
+                    "total_tokens": len(prompt.split()) + len(summary.split()),
+                },
+            }
+
+        if method == "POST" and re.fullmatch(r"/api/v2/podcasts/\w+/episodes/", path):
+            with self._lock:
+                self.uploads.append((headers, body))
+                failed = len(self.uploads) <= self.upload_failures
+            if failed or self._should_fail():
+                return 500, "application/json", {"error": "fake failure"}
+            with self._lock:
+                self.uploaded_bytes += len(body)
+            return 200, "application/json", {"success": True}
+
+        return 404, "application/json", {"error": "not found"}
+
+    def _make_handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def _respond(self, method):
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    body = self._read_chunked()
+                else:
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = self.rfile.read(length) if length else b""
+                path = self.path.split("?", 1)[0]
+                status, content_type, payload = services._route(
+                    method, path, body, dict(self.headers)
+                )
+                if not isinstance(payload, str):
+                    payload = json.dumps(payload)
+                data = payload.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_chunked(self):
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0], 16)
+                    if size == 0:
+                        # Trailers, if any, end with an empty line.
+                        while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                            pass
+                        return b"".join(chunks)
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
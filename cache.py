@@ -0,0 +1,202 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Union
+
+
+def hash_key(*parts: str) -> str:
+    """Build a content-addressed cache key from a list of strings."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+# Eviction frees the cache down to this share of its size, so that a full
+# cache is not walked again on every put.
+FILE_CACHE_LOW_WATER = 0.9
+
+
+class FileCache:
+    """A directory of content-addressed blobs with size-bounded LRU eviction.
+
+    Entries are written to a temporary file and renamed into place, so readers
+    never see a partial blob. Recency is tracked through file mtimes, which
+    also makes the cache safe to share between processes.
+    """
+
+    def __init__(
+        self, cache_dir: str, max_bytes: int, low_water: float = FILE_CACHE_LOW_WATER
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, _, size in self._entries())
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key: str) -> Union[str, None]:
+        """Return the path of a cached blob and mark it as recently used."""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get_bytes(self, key: str) -> Union[bytes, None]:
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # Evicted by another process between the lookup and the read.
+            return None
+
+    def put(self, key: str, data: bytes):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            existed = os.path.exists(path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with self._lock:
+            if not existed:
+                self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, path, stat.st_size
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        self._total_bytes = sum(size for _, _, size in entries)
+        target = self.max_bytes * self.low_water
+        for _, path, size in entries:
+            if self._total_bytes <= target:
+                break
+            logging.debug("Evicting cache entry: %s", path)
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._total_bytes -= size
+
+
+class SQLiteCache:
+    """A persistent string cache in a SQLite file, with TTL and size eviction.
+
+    Entries older than `ttl` seconds are ignored and purged. Past
+    `max_entries`, the least recently used entries are dropped.
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)"
+            )
+            self._conn.execute(
+                "DELETE FROM cache WHERE created < ?", (time.time() - self.ttl,)
+            )
+
+    def get(self, key: str) -> Union[str, None]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND created >= ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE cache SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                "SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": size}
+
+    def close(self):
+        self._conn.close()
+
+
+class SingleFlight:
+    """Compute a value once per key for the lifetime of the object.
+
+    Concurrent callers asking for a key that is being computed wait for the
+    first caller's result, or its exception, instead of computing it again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def get(self, key: str, compute: Callable):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(compute())
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
@@ -0,0 +1,166 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Iterable, Iterator, List
+
+from dtos import Article
+
+TEXT_STORE_DIR = os.environ.get("TEXT_STORE_DIR", ".cache/text")
+# Texts of stories that were never composed are deleted after this many seconds.
+TEXT_STORE_TTL = float(os.environ.get("TEXT_STORE_TTL", 7 * 24 * 3600))
+
+
+class TextStore:
+    """Article texts kept out of the stage files, compressed and addressed by hash.
+
+    Texts stay until `prune` finds them unused for `TEXT_STORE_TTL` seconds,
+    so that a stage can be run again on the same input.
+    """
+
+    def __init__(self, store_dir: str = TEXT_STORE_DIR):
+        self.store_dir = store_dir
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def put(self, text_list: List[str]) -> str:
+        data = json.dumps(text_list).encode("utf-8")
+        key = hashlib.sha256(data).hexdigest()
+        path = self._path(key)
+        if os.path.exists(path):
+            # Storing a text again keeps it from being pruned.
+            os.utime(path)
+        else:
+            fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(gzip.compress(data))
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        return key
+
+    def get(self, key: str) -> List[str]:
+        path = self._path(key)
+        with open(path, "rb") as f:
+            text_list = json.loads(gzip.decompress(f.read()))
+        # Reading a text also keeps it from being pruned.
+        os.utime(path)
+        return text_list
+
+    def load(self, articles: Iterable[Article]) -> Iterator[Article]:
+        """Fill in the text of each article as it is consumed.
+
+        Articles whose text has been pruned are logged and left out.
+        """
+        for article in articles:
+            if article.text_list is None and article.text_ref is not None:
+                try:
+                    article.text_list = self.get(article.text_ref)
+                except FileNotFoundError:
+                    logging.warning(
+                        "Text of story %s is gone, crawl again to include it",
+                        article.source_id,
+                    )
+                    continue
+            yield article
+
+    def prune(self, ttl: float = TEXT_STORE_TTL):
+        """Delete the texts not stored or read in the last `ttl` seconds."""
+        cutoff = time.time() - ttl
+        for entry in os.scandir(self.store_dir):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.store_dir, key + ".json.gz")
+
+
+def read_articles(path: str) -> List[Article]:
+    """Read articles from a JSON list or a JSONL checkpoint.
+
+    In a checkpoint a later line replaces an earlier one for the same article,
+    and a truncated last line, left by a crash, is ignored.
+    """
+    with open(path, "r") as f:
+        content = f.read()
+    if content.lstrip().startswith("["):
+        return [Article.fromdict(a) for a in json.loads(content)]
+
+    articles = {}
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        try:
+            article = Article.fromdict(json.loads(line))
+        except ValueError:
+            logging.warning("Ignoring a truncated line in %s", path)
+            continue
+        articles[(article.source_name, article.source_id)] = article
+    return list(articles.values())
+
+
+class ArticleCheckpoint:
+    """Append finished articles to a JSONL file, one line per article.
+
+    Only `fields` are written, when given. Every line is flushed to disk as it
+    is written, so the next stage can read partial results. A previous file is
+    replaced, unless `resume` is set to continue an interrupted run of the
+    same stage, skipping the articles already done.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        resume: bool = False,
+        fields: Iterable[str] = None,
+        text_store: TextStore = None,
+    ):
+        self.path = path
+        self.fields = fields
+        self.text_store = text_store
+        if not resume and os.path.exists(path):
+            os.remove(path)
+        self.articles = read_articles(path) if os.path.exists(path) else []
+        if self.articles:
+            logging.info(
+                "Resuming from %d articles in %s", len(self.articles), self.path
+            )
+        self._lock = threading.Lock()
+        self._file = open(path, "a+")
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() > 0:
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != "\n":
+                # Start after a line truncated by a crash, not in the middle of it.
+                self._file.write("\n")
+
+    @property
+    def done_ids(self):
+        return {article.source_id for article in self.articles}
+
+    def append(self, article: Article):
+        """Write the article, projected on `fields`, its text goes to the text store."""
+        if self.text_store is not None and article.text_list is not None:
+            article.text_ref = self.text_store.put(article.text_list)
+        with self._lock:
+            self._file.write(json.dumps(article.asdict(self.fields)) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.articles.append(article)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
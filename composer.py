@@ -1,18 +1,66 @@
+import io
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List
+from typing import List, Tuple
 
-from pydub import AudioSegment
+from audio import AudioAssembler, EncoderSettings, normalize_wav
 from dtos import Article
-
-from text_to_speech import TextToSpeech
+from metrics import METRICS
+from segments import (
+    CLOSING,
+    OPENING_TEMPLATE,
+    SUMMARY_PROMPT,
+    SegmentLibrary,
+    date_plug_text,
+    filler_text,
+)
+
+from text_to_speech import TextToSpeech, create_cache, split_batches
+
+TTS_CONCURRENCY = 4
+# Seconds of silence after a segment, and after the end of a story.
+SEGMENT_PAUSE = 0.4
+STORY_PAUSE = 1.0
+INTRO_JINGLE = os.environ.get("INTRO_JINGLE")
+OUTRO_JINGLE = os.environ.get("OUTRO_JINGLE")
 
 
 class Composer:
-    def __init__(self, feed_name: str, date_created: datetime, data_dir: str):
+    def __init__(
+        self,
+        feed_name: str,
+        date_created: datetime,
+        data_dir: str,
+        tts: TextToSpeech = None,
+        concurrency: int = TTS_CONCURRENCY,
+        write_files: bool = False,
+        encoder: EncoderSettings = None,
+        intro_jingle: str = INTRO_JINGLE,
+        outro_jingle: str = OUTRO_JINGLE,
+        library: SegmentLibrary = None,
+    ):
         self.feed_name = feed_name
         self.date_created = date_created
-        self.tts = TextToSpeech()
+        self.tts = tts or TextToSpeech(cache=create_cache())
+        self.concurrency = concurrency
+        # Keep a WAV file of every segment under the data dir, for debugging.
+        self.write_files = write_files
+        # Taken from the output file extension and the environment if None.
+        self.encoder = encoder
+        self.intro_jingle = intro_jingle
+        self.outro_jingle = outro_jingle
+        # text -> WAV bytes synthesized ahead of `compose`, see `prepare_story`,
+        # starting with the phrases of the feed's segment library.
+        self.library = library or SegmentLibrary(
+            feed_name, data_dir, voice=self.tts.voice, rate=self.tts.rate
+        )
+        clips = self.library.load()
+        date_plug = self.library.load_date_plug(date_created.date())
+        if date_plug is not None:
+            clips[date_plug_text(date_created)] = date_plug
+        self._prepared = dict(clips)
+        self._library_phrases = set(clips)
 
         self._data_dir = os.path.join(
             os.path.dirname(__file__),
@@ -25,7 +73,7 @@ class Composer:
             self.feed_name,
             self.date_created.strftime("%Y-%m-%d"),
         )
-        if not os.path.exists(self._date_data_dir):
+        if self.write_files and not os.path.exists(self._date_data_dir):
             os.makedirs(self._date_data_dir)
 
     def compose(
@@ -34,52 +82,130 @@ class Composer:
         output_file: str = "output.mp3",
         note_file: str = "notes.txt",
     ):
-        self._create_audio(article_list, output_file)
+        # Notes first, so that the episode can be uploaded as the audio is encoded.
         self._create_note(article_list, note_file)
+        self._create_audio(article_list, output_file)
 
-    def _create_audio(self, article_list: List[Article], output_file: str):
-        full_audio = AudioSegment.empty()
+    def prepare_story(self, story: Article):
+        """Synthesize the title and summary of a story before the episode is composed."""
+        texts = [story.title, story.summary]
+        for text, audio_data in zip(texts, self._synthesize(texts)):
+            self._prepared[text] = audio_data
 
-        open_path = os.path.join(self._date_data_dir, "open.wav")
-        self.tts.convert(f"Welcome to {self.feed_name} daily!", open_path)
-        full_audio += AudioSegment.from_wav(open_path)
+    @METRICS.timed("Composer._create_audio")
+    def _create_audio(self, article_list: List[Article], output_file: str):
+        segments = self._get_segments(article_list)
+        texts = list(
+            dict.fromkeys(
+                text for text, _, _ in segments if text not in self._prepared
+            )
+        )
 
-        date_plug_path = os.path.join(self._date_data_dir, f"date_plug.wav")
-        self.tts.convert(
-            f"Today is {self.date_created.strftime('%A, %B %d')}",
-            date_plug_path,
+        last_use = {text: idx for idx, (text, _, _) in enumerate(segments)}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            # text -> (future of its batch, texts of the batch)
+            pending = {}
+            for batch in split_batches(texts):
+                future = executor.submit(self._synthesize, batch)
+                for text in batch:
+                    pending[text] = (future, batch)
+            # text -> WAV bytes of the batches already done
+            ready = {}
+
+            with AudioAssembler(output_file, self.encoder) as assembler:
+                if self.intro_jingle:
+                    assembler.append_jingle(self.intro_jingle)
+                for idx, (text, path, pause) in enumerate(segments):
+                    if text in self._prepared:
+                        audio_data = self._prepared[text]
+                    else:
+                        if text not in ready:
+                            future, batch = pending[text]
+                            ready.update(zip(batch, future.result()))
+                            for batch_text in batch:
+                                del pending[batch_text]
+                        audio_data = ready[text]
+                    if self.write_files:
+                        with open(path, "wb") as f:
+                            f.write(audio_data)
+                    assembler.append_wav(io.BytesIO(audio_data))
+                    assembler.append_silence(pause)
+                    if last_use[text] == idx:
+                        # Drop the audio once it is no longer needed.
+                        ready.pop(text, None)
+                        if text not in self._library_phrases:
+                            self._prepared.pop(text, None)
+                if self.outro_jingle:
+                    assembler.append_jingle(self.outro_jingle)
+
+    def _get_segments(
+        self, article_list: List[Article]
+    ) -> List[Tuple[str, str, float]]:
+        """List the (text, wav path, pause after) of every segment, in order."""
+        segments = [
+            (
+                OPENING_TEMPLATE.format(self.feed_name),
+                os.path.join(self._date_data_dir, "open.wav"),
+                SEGMENT_PAUSE,
+            ),
+        ]
+        # From the library when `prepare` built the plug of the day.
+        segments.append(
+            (
+                date_plug_text(self.date_created),
+                os.path.join(self._date_data_dir, "date_plug.wav"),
+                STORY_PAUSE,
+            )
         )
-        full_audio += AudioSegment.from_wav(date_plug_path)
 
-        summary_prompt_path = os.path.join(self._date_data_dir, "summary_prompt.wav")
-        self.tts.convert("This is a summary of the story.", summary_prompt_path)
-        summary_prompt = AudioSegment.from_wav(summary_prompt_path)
+        summary_prompt = (
+            SUMMARY_PROMPT,
+            os.path.join(self._date_data_dir, "summary_prompt.wav"),
+            SEGMENT_PAUSE,
+        )
 
         for idx, story in enumerate(article_list):
-            filler_path = os.path.join(self._data_dir, f"filler_{idx + 1}.wav")
-            filler = self._get_filler(idx, len(article_list))
-            self.tts.convert(filler, filler_path)
-            full_audio += AudioSegment.from_wav(filler_path)
-
-            title_path = os.path.join(
-                self._date_data_dir, f"{story.source_id }_title.wav"
+            segments.append(
+                (
+                    filler_text(idx, len(article_list)),
+                    os.path.join(self._data_dir, f"filler_{idx + 1}.wav"),
+                    SEGMENT_PAUSE,
+                )
+            )
+            segments.append(
+                (
+                    story.title,
+                    os.path.join(self._date_data_dir, f"{story.source_id }_title.wav"),
+                    SEGMENT_PAUSE,
+                )
+            )
+            segments.append(summary_prompt)
+            segments.append(
+                (
+                    story.summary,
+                    os.path.join(self._date_data_dir, f"{story.source_id}.wav"),
+                    STORY_PAUSE,
+                )
             )
-            self.tts.convert(story.title, title_path)
-            full_audio += AudioSegment.from_wav(title_path)
-
-            full_audio += summary_prompt
-
-            audio_path = os.path.join(self._date_data_dir, f"{story.source_id}.wav")
-            self.tts.convert(story.summary, audio_path)
-            full_audio += AudioSegment.from_wav(audio_path)
 
-        close_path = os.path.join(self._date_data_dir, "close.wav")
-        self.tts.convert(
-            "That's it for today's update. Thank you for listening!", close_path
+        segments.append(
+            (
+                CLOSING,
+                os.path.join(self._date_data_dir, "close.wav"),
+                0,
+            )
         )
-        full_audio += AudioSegment.from_wav(close_path)
+        return segments
 
-        full_audio.export(output_file, format="mp3")
+    def _synthesize(self, texts: List[str]) -> List[bytes]:
+        """Synthesize and loudness-normalize texts, on the calling worker thread."""
+        audio_list = self.tts.synthesize_batch(texts)
+        for text, audio_data in zip(texts, audio_list):
+            if audio_data is None:
+                raise RuntimeError(f"Failed to synthesize speech for: {text}")
+        with METRICS.span("normalize_wav"):
+            return [normalize_wav(audio_data) for audio_data in audio_list]
 
     def _create_note(self, article_list: List[Article], note_file: str):
         with open(note_file, "w") as f:
@@ -87,12 +213,3 @@ class Composer:
                 f.write(
                     f"<a href='{story.url}'>{story.title}</a><br><b>Summary:</b> {story.summary}<br>"
                 )
-
-    def _get_filler(self, idx: int, num_stories: int) -> str:
-        if idx <= 3:
-            filler = f"Story number {idx + 1}."
-        elif idx == num_stories - 1:
-            filler = "Last story of the day."
-        else:
-            filler = "Next story."
-        return filler
@@ -1,29 +1,253 @@
 import logging
-from typing import List
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Collection, Dict, Iterator, List, Tuple, Union
 
+import requests
+
+from cache import SingleFlight
+from crawler.index import CrawlIndex, content_hash
+from dedup import Deduplicator
 from dtos import Article
+from metrics import METRICS
+
+PARSE_NUM_WORKERS = 4
+PARSE_TIMEOUT = 120
+PAGE_CHECK_TIMEOUT = 10
 
 
 class BaseCrawler:
-    def __init__(self, parser):
+    def __init__(
+        self,
+        parser,
+        num_workers: int = PARSE_NUM_WORKERS,
+        parse_timeout: float = PARSE_TIMEOUT,
+        index: CrawlIndex = None,
+        session: requests.Session = None,
+        pages: SingleFlight = None,
+        dedup: Deduplicator = None,
+    ):
         self.parser = parser
+        self.num_workers = num_workers
+        self.parse_timeout = parse_timeout
+        self.index = index
+        self.session = session or requests.Session()
+        # Shared between crawlers so a URL in several feeds is fetched once.
+        self.pages = pages
+        # Drops repeated stories before they are parsed or summarized.
+        self.dedup = dedup
+        # url -> reason, for the articles that failed in the last crawl.
+        self.failures: Dict[str, str] = {}
 
     def get_articles(self, max_num_articles: int) -> List[Article]:
-        article_list = []
-        for article in self.get_article_list(max_num_articles):
-            try:
-                self.parse_article(article)
-            except:
-                logging.warning("Failed to parse article: %s", article.url)
-                continue
-            article_list.append(article)
-            if len(article_list) >= max_num_articles:
-                break
-        return article_list
+        """Parse candidate articles in parallel, return the first successes in rank order.
+
+        Up to `num_workers` articles are parsed at a time, each given at most
+        `parse_timeout` seconds. The result is the same as parsing the
+        candidates one by one: the first `max_num_articles` that parse
+        successfully, in the order the crawler produced them.
+        """
+        return list(self.iter_articles(max_num_articles))
+
+    def iter_articles(
+        self, max_num_articles: int, skip_ids: Collection = ()
+    ) -> Iterator[Article]:
+        """Like `get_articles`, but yield each article as soon as its rank is settled.
+
+        Candidates whose source id is in `skip_ids` are left out, e.g. the
+        articles a previous run already produced. With a deduplicator, a
+        candidate at the same page as an earlier article is not parsed, and
+        one with nearly the same text is dropped; the next candidates take
+        their places. An article is only remembered once it has parsed, see
+        also `forget`.
+        """
+        self.failures = {}
+        candidates = (
+            article
+            for article in METRICS.timed_iter(
+                "get_article_list",
+                self.get_article_list(max_num_articles + len(skip_ids)),
+            )
+            if article.source_id not in skip_ids and not self._is_duplicate_url(article)
+        )
+        exhausted = False
+        # Ordered [article, future, deadline, ok]; ok is None while unresolved
+        # and the deadline is set once the parse starts running.
+        slots = []
+        # Successes still in `slots`, and successes already yielded.
+        num_succeeded = 0
+        num_yielded = 0
+
+        # A parse that times out keeps running in the background, the extra
+        # threads keep such stragglers from starving the rest of the stage.
+        executor = ThreadPoolExecutor(max_workers=self.num_workers * 2)
+        try:
+            while True:
+                running = [s for s in slots if s[3] is None]
+                while (
+                    not exhausted
+                    and len(running) < self.num_workers
+                    and num_yielded + num_succeeded + len(running) < max_num_articles
+                ):
+                    try:
+                        article = next(candidates)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    slot = [article, None, None, None]
+                    slot[1] = executor.submit(self._parse_slot, slot)
+                    slots.append(slot)
+                    running.append(slot)
+
+                if not running:
+                    break
+
+                timeout = None
+                if self.parse_timeout:
+                    # A parse that has not started yet cannot time out sooner.
+                    timeout = min(
+                        [self.parse_timeout]
+                        + [s[2] - time.monotonic() for s in running if s[2]]
+                    )
+                    timeout = max(0, timeout)
+                wait([s[1] for s in running], timeout, return_when=FIRST_COMPLETED)
+
+                now = time.monotonic()
+                for slot in running:
+                    article, future, deadline, _ = slot
+                    if future.done():
+                        error = future.exception()
+                        slot[3] = error is None
+                        if error is not None:
+                            self._record_failure(article, repr(error))
+                    elif deadline is not None and now >= deadline:
+                        future.cancel()
+                        slot[3] = False
+                        self._record_failure(
+                            article, f"timed out after {self.parse_timeout}s"
+                        )
+                    else:
+                        continue
+                    if slot[3]:
+                        num_succeeded += 1
+
+                # Yield the successes whose earlier candidates have all resolved.
+                while slots and slots[0][3] is not None:
+                    article, _, _, ok = slots.pop(0)
+                    if ok:
+                        num_succeeded -= 1
+                        if not self._is_duplicate(article):
+                            num_yielded += 1
+                            yield article
+                    if num_yielded >= max_num_articles:
+                        return
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            if hasattr(candidates, "close"):
+                candidates.close()
 
     def get_article_list(self, max_num_articles: int) -> List[Article]:
         raise NotImplementedError()
 
+    def _parse_slot(self, slot: list) -> Article:
+        if self.parse_timeout:
+            slot[2] = time.monotonic() + self.parse_timeout
+        return self.parse_article(slot[0])
+
     def parse_article(self, article: Article) -> Article:
-        article.text_list = self.parser.get_url_content(article.url)
+        if self.pages is None:
+            article.text_list = self._fetch_page(article.url)
+        else:
+            url = article.url
+            article.text_list = list(self.pages.get(url, lambda: self._fetch_page(url)))
         return article
+
+    def _fetch_page(self, url: str) -> List[str]:
+        if self.index is None:
+            return self._get_url_page(url)[0]
+
+        cached = self.index.get_page(url)
+        fresh = cached and time.time() - cached["fetched"] < self.index.page_ttl
+        if fresh:
+            logging.info("Using indexed content for URL: %s", url)
+            METRICS.incr("crawl_index_hits")
+            return cached["text_list"]
+
+        # Only a page indexed before can be unchanged, a new one is fetched once
+        # and its validators kept for the next crawl.
+        etag = last_modified = None
+        if cached is not None:
+            not_modified, etag, last_modified = self._check_page(url, cached)
+            if not_modified:
+                logging.info("URL not modified since last crawl: %s", url)
+                self.index.touch_page(url)
+                METRICS.incr("crawl_not_modified")
+                return cached["text_list"]
+
+        text_list, validators = self._get_url_page(url)
+        if cached is not None and content_hash(text_list) == cached["content_hash"]:
+            logging.info("URL content unchanged since last crawl: %s", url)
+            METRICS.incr("crawl_unchanged")
+        # The response of the page itself is the best source of its validators.
+        self.index.put_page(
+            url,
+            text_list,
+            validators.get("etag", etag),
+            validators.get("last_modified", last_modified),
+        )
+        return text_list
+
+    def _get_url_page(self, url: str) -> Tuple[List[str], Dict[str, str]]:
+        with METRICS.span("get_url_content"):
+            if hasattr(self.parser, "get_url_page"):
+                return self.parser.get_url_page(url)
+            return self.parser.get_url_content(url), {}
+
+    def _check_page(
+        self, url: str, cached: dict
+    ) -> Tuple[bool, Union[str, None], Union[str, None]]:
+        """Send a conditional HEAD request for an indexed page.
+
+        Return whether the page is unchanged, and its ETag and Last-Modified.
+        """
+        headers = {}
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+        try:
+            req = self.session.head(
+                url, headers=headers, allow_redirects=True, timeout=PAGE_CHECK_TIMEOUT
+            )
+        except requests.RequestException as e:
+            logging.info("Conditional request failed for %s: %s", url, e)
+            return False, None, None
+        return (
+            bool(headers) and req.status_code == 304,
+            req.headers.get("ETag"),
+            req.headers.get("Last-Modified"),
+        )
+
+    def forget(self, article: Article):
+        """Let a later copy of an article through, e.g. when its summary failed."""
+        if self.dedup is not None:
+            self.dedup.forget(article)
+
+    def _is_duplicate_url(self, article: Article) -> bool:
+        original = self.dedup and self.dedup.find_url(article)
+        if original:
+            logging.info("Skipping %s, same page as %s", article.url, original)
+            METRICS.incr("duplicate_stories")
+        return bool(original)
+
+    def _is_duplicate(self, article: Article) -> bool:
+        original = self.dedup and self.dedup.check(article)
+        if original:
+            logging.info("Skipping %s, same story as %s", article.url, original)
+            METRICS.incr("duplicate_stories")
+        return bool(original)
+
+    def _record_failure(self, article: Article, reason: str):
+        logging.warning("Failed to parse article: %s (%s)", article.url, reason)
+        METRICS.incr("parse_failures")
+        self.failures[article.url] = reason
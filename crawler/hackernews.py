@@ -1,33 +1,114 @@
 import logging
 import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
+from requests.adapters import HTTPAdapter
+
 from dtos import Article
 from crawler.base import BaseCrawler
 
 HN_SOURCE = "Hackernews"
 HN_TOPSTORIES_URL = "https://hacker-news.firebaseio.com/v0/topstories.json"
 HN_ITEM_URL = "https://hacker-news.firebaseio.com/v0/item/{}.json"
+HN_MAX_WORKERS = 8
+
+
+def create_session(pool_size: int = HN_MAX_WORKERS) -> requests.Session:
+    """Create a requests session with a connection pool large enough for the workers."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 
 class HackerNewsCrawler(BaseCrawler):
+    def __init__(
+        self,
+        parser,
+        max_workers: int = HN_MAX_WORKERS,
+        session: requests.Session = None,
+        topstories_url: str = HN_TOPSTORIES_URL,
+        item_url: str = HN_ITEM_URL,
+        **kwargs,
+    ):
+        super().__init__(
+            parser, session=session or create_session(max_workers), **kwargs
+        )
+        self.max_workers = max_workers
+        self.topstories_url = topstories_url
+        self.item_url = item_url
+
     def get_article_list(self, max_num_stories: int) -> List[Article]:
-        """Get the top stories from Hacker News."""
+        """Get the top stories from Hacker News.
+
+        Items are fetched concurrently but yielded in rank order. At most
+        `max_num_stories` usable items are requested ahead of the consumer, so
+        no requests are sent past the stories that are still needed.
+        """
         logging.info("Getting top stories from Hacker News")
-        top_story_ids = requests.get(HN_TOPSTORIES_URL).json()
-
-        for count, story_id in enumerate(top_story_ids):
-            story = requests.get(HN_ITEM_URL.format(story_id)).json()
-            if self._should_skip(story):
-                continue
-            article = Article(
-                source_name=HN_SOURCE,
-                source_id=story_id,
-                source_rank=count,
-                title=story["title"],
-                url=story.get("url", None),
+        top_story_ids = self.session.get(self.topstories_url).json()
+        story_ids = iter(enumerate(top_story_ids))
+
+        num_found = 0
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while True:
+                window = max(1, min(self.max_workers, max_num_stories - num_found))
+                while len(pending) < window:
+                    try:
+                        count, story_id = next(story_ids)
+                    except StopIteration:
+                        break
+                    pending.append(
+                        (count, story_id, executor.submit(self._get_story, story_id))
+                    )
+                if not pending:
+                    break
+
+                count, story_id, future = pending.popleft()
+                try:
+                    story = future.result()
+                except requests.RequestException as e:
+                    logging.warning("Failed to get story %s: %s", story_id, e)
+                    continue
+                if story is None or self._should_skip(story):
+                    continue
+                num_found += 1
+                yield Article(
+                    source_name=HN_SOURCE,
+                    source_id=story_id,
+                    source_rank=count,
+                    title=story["title"],
+                    url=story.get("url", None),
+                )
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_story(self, story_id):
+        """Fetch an item, or take it from the index. Known skipped items return None."""
+        if self.index is not None:
+            record = self.index.get_item(HN_SOURCE, story_id)
+            if record is not None:
+                if record["skip"]:
+                    return None
+                return {"id": story_id, "title": record["title"], "url": record["url"]}
+
+        req = self.session.get(self.item_url.format(story_id))
+        req.raise_for_status()
+        story = req.json()
+        if self.index is not None and story is not None:
+            self.index.put_item(
+                HN_SOURCE,
+                story_id,
+                story.get("title"),
+                story.get("url"),
+                self._should_skip(story),
             )
-            yield article
+        return story
 
     def _should_skip(self, story):
         if "url" not in story or story["url"] is None:
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Union
+
+CRAWL_INDEX_PATH = os.environ.get("CRAWL_INDEX_PATH", ".cache/crawl_index.sqlite")
+# How long an item or page is trusted without asking the server again.
+ITEM_TTL = 24 * 3600
+PAGE_TTL = 6 * 3600
+# How long an item or page is kept at all since it was last fetched.
+INDEX_MAX_AGE = 30 * 24 * 3600
+
+
+def content_hash(text_list: List[str]) -> str:
+    return hashlib.sha256("\n".join(text_list).encode("utf-8")).hexdigest()
+
+
+class CrawlIndex:
+    """A persistent record of the items and pages seen by previous crawls.
+
+    Items are source stories (id, title, url and whether the crawler skips
+    them), pages are parsed article URLs with their text and HTTP validators.
+    """
+
+    def __init__(
+        self,
+        path: str = CRAWL_INDEX_PATH,
+        item_ttl: float = ITEM_TTL,
+        page_ttl: float = PAGE_TTL,
+        max_age: float = INDEX_MAX_AGE,
+    ):
+        self.path = path
+        self.item_ttl = item_ttl
+        self.page_ttl = page_ttl
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                "source_name TEXT NOT NULL, item_id TEXT NOT NULL, "
+                "title TEXT, url TEXT, skip INTEGER NOT NULL, fetched REAL NOT NULL, "
+                "PRIMARY KEY (source_name, item_id))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "url TEXT PRIMARY KEY, text_list TEXT NOT NULL, "
+                "content_hash TEXT NOT NULL, etag TEXT, last_modified TEXT, "
+                "fetched REAL NOT NULL)"
+            )
+        self.prune()
+
+    def get_item(self, source_name: str, item_id) -> Union[dict, None]:
+        """Return a fresh item record, skipped items never expire."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT title, url, skip, fetched FROM items "
+                "WHERE source_name = ? AND item_id = ?",
+                (source_name, str(item_id)),
+            ).fetchone()
+        if row is None:
+            return None
+        title, url, skip, fetched = row
+        if not skip and time.time() - fetched > self.item_ttl:
+            return None
+        return {"title": title, "url": url, "skip": bool(skip)}
+
+    def put_item(self, source_name: str, item_id, title, url, skip: bool):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?)",
+                (source_name, str(item_id), title, url, int(skip), time.time()),
+            )
+
+    def get_page(self, url: str) -> Union[dict, None]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text_list, content_hash, etag, last_modified, fetched "
+                "FROM pages WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        text_list, digest, etag, last_modified, fetched = row
+        return {
+            "text_list": json.loads(text_list),
+            "content_hash": digest,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched": fetched,
+        }
+
+    def put_page(
+        self,
+        url: str,
+        text_list: List[str],
+        etag: str = None,
+        last_modified: str = None,
+    ):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    json.dumps(text_list),
+                    content_hash(text_list),
+                    etag,
+                    last_modified,
+                    time.time(),
+                ),
+            )
+
+    def touch_page(self, url: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE pages SET fetched = ? WHERE url = ?", (time.time(), url)
+            )
+
+    def prune(self) -> int:
+        """Delete the items and pages older than `max_age`, return how many."""
+        cutoff = time.time() - self.max_age
+        with self._lock, self._conn:
+            num_items = self._conn.execute(
+                "DELETE FROM items WHERE fetched < ?", (cutoff,)
+            ).rowcount
+            num_pages = self._conn.execute(
+                "DELETE FROM pages WHERE fetched < ?", (cutoff,)
+            ).rowcount
+        if num_items or num_pages:
+            logging.info(
+                "Pruned %d items and %d pages from the crawl index",
+                num_items,
+                num_pages,
+            )
+        return num_items + num_pages
+
+    def close(self):
+        self._conn.close()
@@ -6,12 +6,15 @@ from playwright.sync_api import sync_playwright
 from crawler.base import BaseCrawler
 
 from dtos import Article
+from webparser import BrowserPool
 
 WSJ_SOURCE = "Wall Street Journal"
 WSJ_URL = "https://www.wsj.com/"
 
 
-def get_page(url):
+def get_page(url, pool: BrowserPool = None):
+    if pool is not None:
+        return pool.get_content(url)
     with sync_playwright() as p:
         browser = p.chromium.launch()
         page = browser.new_page()
@@ -23,8 +26,12 @@ def get_page(url):
 
 
 class WSJCrawler(BaseCrawler):
+    def __init__(self, parser, pool: BrowserPool = None, **kwargs):
+        super().__init__(parser, **kwargs)
+        self.pool = pool
+
     def get_article_list(self, max_num_stories: int) -> List[Article]:
-        html = get_page(WSJ_URL)
+        html = get_page(WSJ_URL, self.pool)
 
         soup = BeautifulSoup(html, "html.parser")
 
@@ -0,0 +1,220 @@
+import hashlib
+import os
+import re
+import threading
+from typing import Dict, List, Set, Tuple, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from dtos import Article
+
+# Estimated Jaccard similarity of word shingles above which two stories are
+# the same. Syndicated and reposted copies score well above it, two outlets
+# covering the same event in their own words usually do not.
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0.4"))
+DEDUP_NUM_PERM = 64
+# 32 bands of 2 rows make stories that share more than ~20% of their shingles
+# candidates, so few pairs above the threshold are missed.
+DEDUP_BANDS = 32
+SHINGLE_SIZE = 3
+
+WORD_PATTERN = re.compile(r"\w+")
+TRACKING_PARAM_PATTERN = re.compile(
+    r"^(utm_\w+|ref|ref_src|fbclid|gclid|mc_cid|mc_eid|cmpid|smid)$"
+)
+HOST_PREFIXES = ("www.", "m.", "amp.", "mobile.")
+PATH_SUFFIX_PATTERN = re.compile(r"(/amp|/index\.html?|/)+$")
+# Larger than any bin minimum, 64-bit hashes divided by the number of bins.
+_BORROW_OFFSET = 1 << 64
+
+
+def canonicalize_url(url: str) -> str:
+    """Reduce a URL to the parts that identify the page.
+
+    The scheme, port, fragment, tracking parameters, mobile and AMP variants
+    of the host and path are dropped, and the query parameters are sorted.
+    """
+    parts = urlsplit(url.strip())
+    host = parts.hostname or ""
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix) :]
+            break
+    path = PATH_SUFFIX_PATTERN.sub("", re.sub("/+", "/", parts.path))
+    query = urlencode(
+        sorted(
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not TRACKING_PARAM_PATTERN.match(key.lower())
+        )
+    )
+    return f"{host}{path}?{query}" if query else f"{host}{path}"
+
+
+def shingle_hashes(text_list: List[str], size: int = SHINGLE_SIZE) -> Set[int]:
+    """Hash every run of `size` consecutive words of a text to 64 bits."""
+    words = WORD_PATTERN.findall(" ".join(text_list).lower())
+    # A text shorter than a shingle is a single shingle.
+    count = max(len(words) - size + 1, 1) if words else 0
+    return {
+        int.from_bytes(
+            hashlib.blake2b(
+                " ".join(words[i : i + size]).encode("utf-8"), digest_size=8
+            ).digest(),
+            "little",
+        )
+        for i in range(count)
+    }
+
+
+class MinHash:
+    """One-permutation MinHash signatures.
+
+    Rather than hashing every shingle once per permutation, each shingle hash
+    goes to one of `num_perm` bins and every bin keeps its minimum, a single
+    pass over the shingles. Empty bins, from texts shorter than the signature,
+    borrow the minimum of the next non-empty bin so that they still agree
+    between similar texts.
+    """
+
+    def __init__(self, num_perm: int = DEDUP_NUM_PERM):
+        self.num_perm = num_perm
+
+    def signature(self, hashes: Set[int]) -> Union[Tuple[int, ...], None]:
+        if not hashes:
+            return None
+        bins = [None] * self.num_perm
+        for value in hashes:
+            idx = value % self.num_perm
+            value //= self.num_perm
+            if bins[idx] is None or value < bins[idx]:
+                bins[idx] = value
+        signature = []
+        for idx in range(self.num_perm):
+            distance = 0
+            while bins[(idx + distance) % self.num_perm] is None:
+                distance += 1
+            # Offset borrowed minimums so they only match other borrowed ones.
+            value = bins[(idx + distance) % self.num_perm]
+            signature.append(value + distance * _BORROW_OFFSET)
+        return tuple(signature)
+
+
+def similarity(signature: Tuple[int, ...], other: Tuple[int, ...]) -> float:
+    """Estimate the Jaccard similarity of the shingles behind two signatures."""
+    return sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+
+
+class Deduplicator:
+    """Spot stories that repeat an earlier one, by canonical URL or by text.
+
+    Stories are checked in rank order and the first one of a group is kept.
+    Texts are compared through MinHash signatures bucketed by LSH bands, so a
+    new story is only compared with the few earlier ones that share a band,
+    and checking `n` stories takes time linear in `n`. A story that fails
+    after it was kept can be forgotten, so that a later copy takes its place.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEDUP_THRESHOLD,
+        num_perm: int = DEDUP_NUM_PERM,
+        bands: int = DEDUP_BANDS,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.minhash = MinHash(num_perm)
+        self._lock = threading.Lock()
+        # canonical URL -> URL of the first story with it.
+        self._urls: Dict[str, str] = {}
+        # (band, rows) -> indexes into `_signatures`.
+        self._buckets: Dict[tuple, List[int]] = {}
+        # None for forgotten stories, so that the indexes stay valid.
+        self._signatures: List[Union[Tuple[Tuple[int, ...], str], None]] = []
+        # URL -> index into `_signatures`.
+        self._text_urls: Dict[str, int] = {}
+
+    def find_url(self, article: Article) -> Union[str, None]:
+        """Return the URL of an earlier story at the same page, if any."""
+        if not article.url:
+            return None
+        with self._lock:
+            return self._urls.get(canonicalize_url(article.url))
+
+    def check_url(self, article: Article) -> Union[str, None]:
+        """Like `find_url`, and remember this story if it is new."""
+        if not article.url:
+            return None
+        key = canonicalize_url(article.url)
+        with self._lock:
+            if key in self._urls:
+                return self._urls[key]
+            self._urls[key] = article.url
+        return None
+
+    def check_text(self, article: Article) -> Union[str, None]:
+        """Like `check_url`, for an earlier story with nearly the same text."""
+        signature, keys = self._text_keys(article)
+        if signature is None:
+            return None
+        with self._lock:
+            original = self._find_text(signature, keys)
+            if original is None:
+                self._add_text(article.url, signature, keys)
+        return original
+
+    def check(self, article: Article) -> Union[str, None]:
+        """Check both the URL and the text, remember the story only if it is new."""
+        signature, keys = self._text_keys(article)
+        key = canonicalize_url(article.url) if article.url else None
+        with self._lock:
+            original = self._urls.get(key) if key else None
+            if original is None and signature is not None:
+                original = self._find_text(signature, keys)
+            if original is None:
+                if key:
+                    self._urls[key] = article.url
+                if signature is not None:
+                    self._add_text(article.url, signature, keys)
+        return original
+
+    def forget(self, article: Article):
+        """Forget a story that was kept, e.g. one whose summary failed."""
+        if not article.url:
+            return
+        key = canonicalize_url(article.url)
+        with self._lock:
+            if self._urls.get(key) == article.url:
+                del self._urls[key]
+            idx = self._text_urls.pop(article.url, None)
+            if idx is not None:
+                self._signatures[idx] = None
+
+    def _text_keys(self, article: Article):
+        signature = self.minhash.signature(shingle_hashes(article.text_list or []))
+        if signature is None:
+            return None, []
+        rows = len(signature) // self.bands
+        keys = [
+            (band, signature[band * rows : (band + 1) * rows])
+            for band in range(self.bands)
+        ]
+        return signature, keys
+
+    def _find_text(self, signature, keys) -> Union[str, None]:
+        candidates = {idx for key in keys for idx in self._buckets.get(key, ())}
+        for idx in sorted(candidates):
+            if self._signatures[idx] is None:
+                continue
+            other, url = self._signatures[idx]
+            if similarity(signature, other) >= self.threshold:
+                return url
+        return None
+
+    def _add_text(self, url: str, signature, keys):
+        for key in keys:
+            self._buckets.setdefault(key, []).append(len(self._signatures))
+        if url:
+            self._text_urls[url] = len(self._signatures)
+        self._signatures.append((signature, url))
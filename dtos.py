@@ -1,9 +1,15 @@
 import dataclasses
 from dataclasses import dataclass
-from typing import List, Union
+from typing import Iterable, List, Union
 
+# Fields kept when an article is serialized after each stage. The article text
+# is only needed for summarization, it can live in a `TextStore` side store
+# and be referenced by `text_ref`.
+CRAWL_FIELDS = ("source_name", "source_id", "source_rank", "title", "url", "text_ref")
+SUMMARY_FIELDS = CRAWL_FIELDS + ("summary",)
 
-@dataclass
+
+@dataclass(slots=True)
 class Article:
     source_name: str
     source_id: str
@@ -14,10 +20,13 @@ class Article:
     text_list: Union[List[str], None] = None
     content: Union[str, None] = None
     summary: Union[str, None] = None
+    text_ref: Union[str, None] = None
 
-    def asdict(self):
-        return dataclasses.asdict(self)
+    def asdict(self, fields: Iterable[str] = None):
+        if fields is None:
+            return dataclasses.asdict(self)
+        return {field: getattr(self, field) for field in fields}
 
     @staticmethod
     def fromdict(obj):
-        return Article(**obj)
\ No newline at end of file
+        return Article(**obj)
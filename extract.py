@@ -0,0 +1,141 @@
+import re
+from collections import defaultdict
+from typing import List
+
+import lxml.etree
+import lxml.html
+
+# Tags that never hold article text.
+BOILERPLATE_TAGS = [
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "svg",
+    "iframe",
+    "button",
+    "nav",
+    "header",
+    "footer",
+    "aside",
+]
+# Class and id words of elements that do not hold article text, matched
+# against whole tokens so that e.g. "shareholders" or "navy" are kept.
+BOILERPLATE_WORDS = {
+    "comment",
+    "comments",
+    "share",
+    "social",
+    "sidebar",
+    "footer",
+    "header",
+    "menu",
+    "nav",
+    "navbar",
+    "promo",
+    "related",
+    "subscribe",
+    "newsletter",
+    "cookie",
+    "cookies",
+    "banner",
+    "advert",
+    "ad",
+    "ads",
+}
+TOKEN_SEPARATOR_PATTERN = re.compile(r"[\s_-]+")
+# lxml refuses str input that declares its own encoding.
+XML_DECLARATION_PATTERN = re.compile(r"^\s*<\?xml[^>]*\?>")
+TEXT_TAGS = ["p", "h1", "h2", "h3", "h4", "h5", "h6", "li", "blockquote", "pre"]
+MIN_PARAGRAPH_CHARS = 25
+# Forms are search boxes and sign-ups, unless they wrap a page like ASP.NET
+# sites do, so one is only dropped when its paragraphs hold less text.
+FORM_MIN_TEXT_CHARS = 200
+
+
+def extract_text_list(html: str) -> List[str]:
+    """Extract the main text of a page as a list of paragraphs, using lxml only.
+
+    Boilerplate tags are dropped, then the element whose paragraphs hold the
+    most text, counting a share of each paragraph towards its grandparent, is
+    taken as the article body. Paragraphs under elements with a boilerplate
+    class or id only count when there are no others, since such a class may
+    be on a wrapper of the whole page, and those elements are only dropped
+    inside the body. An unparsable page gives an empty list.
+    """
+    if not html or not html.strip():
+        return []
+    try:
+        doc = lxml.html.document_fromstring(XML_DECLARATION_PATTERN.sub("", html))
+    except (lxml.etree.ParserError, ValueError):
+        return []
+    for element in list(doc.iter(*BOILERPLATE_TAGS)):
+        element.drop_tree()
+    for form in list(doc.iter("form")):
+        if _paragraph_chars(form) < FORM_MIN_TEXT_CHARS:
+            form.drop_tree()
+    marked = {
+        element
+        for element in doc.iter()
+        if isinstance(element.tag, str)
+        and element.tag not in ("html", "body", "article")
+        and _is_boilerplate(element)
+    }
+
+    paragraphs = []
+    for paragraph in doc.iter("p", "pre", "blockquote"):
+        text_len = len(_text(paragraph))
+        if text_len >= MIN_PARAGRAPH_CHARS and paragraph.getparent() is not None:
+            paragraphs.append((paragraph, text_len))
+    unmarked = [
+        (paragraph, text_len)
+        for paragraph, text_len in paragraphs
+        if not any(ancestor in marked for ancestor in paragraph.iterancestors())
+    ]
+    scores = defaultdict(float)
+    for paragraph, text_len in unmarked or paragraphs:
+        parent = paragraph.getparent()
+        scores[parent] += text_len
+        grandparent = parent.getparent()
+        if grandparent is not None:
+            scores[grandparent] += text_len / 2
+
+    body = max(scores, key=scores.get) if scores else doc.body
+    if body is None:
+        return []
+    for element in list(body.iterdescendants()):
+        if element in marked:
+            element.drop_tree()
+
+    text_list = []
+    for element in body.iter(*TEXT_TAGS):
+        # Nested text tags, e.g. a <p> in an <li>, are covered by the outer one.
+        if any(ancestor.tag in TEXT_TAGS for ancestor in element.iterancestors()):
+            continue
+        text = _text(element)
+        if text:
+            text_list.append(text)
+    return text_list
+
+
+def readability_text_list(html: str) -> List[str]:
+    from readabilipy import simple_json_from_html_string
+
+    article = simple_json_from_html_string(html, use_readability=True)
+    return [t["text"] for t in article["plain_text"]]
+
+
+def _is_boilerplate(element) -> bool:
+    attrs = " ".join([element.get("class", ""), element.get("id", "")]).lower()
+    return any(
+        token in BOILERPLATE_WORDS for token in TOKEN_SEPARATOR_PATTERN.split(attrs)
+    )
+
+
+def _paragraph_chars(element) -> int:
+    lengths = (len(_text(paragraph)) for paragraph in element.iter("p"))
+    return sum(length for length in lengths if length >= MIN_PARAGRAPH_CHARS)
+
+
+def _text(element) -> str:
+    return " ".join(element.text_content().split())
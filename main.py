@@ -1,16 +1,16 @@
 import os
 import datetime
-import json
+import importlib
 import logging
 
 import click
 import pytz
-from composer import Composer
-from crawler import HackerNewsCrawler
-from dtos import Article
-from podcast.castos import CastosPodcast
-from summary import OpenAISummarizer
-from webparser import ChromeExtensionBypassPaywallParser, SimpleParser
+from checkpoint import ArticleCheckpoint, TextStore, read_articles
+from dtos import CRAWL_FIELDS, SUMMARY_FIELDS
+from metrics import METRICS
+
+# Each command imports what it needs, playwright, openai, transformers, pydub
+# and the speech SDK are slow to import and only used by one command each.
 
 logging.basicConfig(
     level=logging.DEBUG, format="%(name)s - %(levelname)s - %(message)s"
@@ -24,47 +24,157 @@ MAX_NUM_STORIES = 10
 MAX_NUM_SUMMARIES = 10
 
 
+def default_from(module: str, name: str):
+    """Take an option default from the module that owns it, when it is needed."""
+    return lambda: getattr(importlib.import_module(module), name)
+
+
+PARSE_NUM_WORKERS = default_from("crawler.base", "PARSE_NUM_WORKERS")
+PARSE_TIMEOUT = default_from("crawler.base", "PARSE_TIMEOUT")
+SUMMARY_NUM_WORKERS = default_from("summary", "SUMMARY_NUM_WORKERS")
+TTS_CONCURRENCY = default_from("composer", "TTS_CONCURRENCY")
+FEED_NUM_WORKERS = default_from("batch", "BATCH_FEED_WORKERS")
+LIBRARY_DATE_PLUG_DAYS = default_from("segments", "LIBRARY_DATE_PLUG_DAYS")
+
+
 @click.group()
-def cli():
-    pass
+@click.option("--metrics-output", help="Write a JSON timing and counter report.")
+@click.option("--prometheus-output", help="Write a Prometheus textfile report.")
+@click.pass_context
+def cli(ctx, metrics_output, prometheus_output):
+    def write_metrics():
+        logging.info("Run metrics: %s", METRICS.report())
+        if metrics_output:
+            METRICS.write_json(metrics_output)
+        if prometheus_output:
+            METRICS.write_prometheus(prometheus_output)
+
+    ctx.call_on_close(write_metrics)
+
+
+def create_parser(
+    workers: int, always_browser: bool = False, session=None, parse_timeout=None
+):
+    """Plain HTTP first with browser escalation, or the browser for every page.
+
+    Browser tabs are closed once a page takes longer than `parse_timeout`.
+    """
+    from crawler.base import PARSE_TIMEOUT
+    from crawler.hackernews import create_session
+    from webparser import ChromeExtensionBypassPaywallParser, SimpleParser, TieredParser
+
+    if parse_timeout is None:
+        parse_timeout = PARSE_TIMEOUT
+    browser_parser = ChromeExtensionBypassPaywallParser(
+        num_pages=workers, page_timeout=parse_timeout or None
+    )
+    if always_browser:
+        return browser_parser
+    return TieredParser(
+        SimpleParser(session=session or create_session(workers)), browser_parser
+    )
 
 
 @cli.command()
 @click.option("--max-stories", default=MAX_NUM_STORIES)
 @click.option("--output", default="stories.json")
-def crawl(max_stories, output):
-    parser = ChromeExtensionBypassPaywallParser()
-    crawler = HackerNewsCrawler(parser)
-    article_list = crawler.get_articles(max_stories)
-    with open(output, "w") as f:
-        f.write(json.dumps([a.asdict() for a in article_list]))
+@click.option("--workers", default=PARSE_NUM_WORKERS, type=int)
+@click.option("--parse-timeout", default=PARSE_TIMEOUT, type=float)
+@click.option("--full", is_flag=True, help="Ignore the index of previous crawls.")
+@click.option("--resume", is_flag=True, help="Continue an interrupted run.")
+@click.option("--always-browser", is_flag=True, help="Load every page in the browser.")
+@click.option("--keep-duplicates", is_flag=True, help="Keep near-duplicate stories.")
+def crawl(
+    max_stories,
+    output,
+    workers,
+    parse_timeout,
+    full,
+    resume,
+    always_browser,
+    keep_duplicates,
+):
+    from crawler import HackerNewsCrawler
+    from crawler.index import CrawlIndex
+    from dedup import Deduplicator
+
+    with ArticleCheckpoint(
+        output, resume=resume, fields=CRAWL_FIELDS, text_store=TextStore()
+    ) as checkpoint:
+        remaining = max_stories - len(checkpoint.articles)
+        if remaining <= 0:
+            return
+        index = None if full else CrawlIndex()
+        with create_parser(
+            workers, always_browser, parse_timeout=parse_timeout
+        ) as parser:
+            crawler = HackerNewsCrawler(
+                parser,
+                num_workers=workers,
+                parse_timeout=parse_timeout,
+                index=index,
+                dedup=None if keep_duplicates else Deduplicator(),
+            )
+            for article in crawler.iter_articles(
+                remaining, skip_ids=checkpoint.done_ids
+            ):
+                checkpoint.append(article)
+                article.text_list = None
+    for url, reason in crawler.failures.items():
+        logging.info("Skipped %s: %s", url, reason)
 
 
 @cli.command()
 @click.option("--max-summaries", default=MAX_NUM_SUMMARIES)
 @click.option("--input", default="stories.json")
 @click.option("--output", default="stories_with_summary.json")
-def summary(max_summaries, input, output):
-    with open(input, "r") as f:
-        article_list = [Article.fromdict(a) for a in json.loads(f.read())]
-
-    summarizer = OpenAISummarizer()
-    summarized_article_list = []
-    for article in article_list:
-        summary = summarizer.summarize(article.text_list)
-        if not summary:
-            logging.warning(
-                "Failed to generate summary for story: %s", article.source_id
-            )
-            continue
-        article.summary = summary
-        summarized_article_list.append(article)
+@click.option("--workers", default=SUMMARY_NUM_WORKERS, type=int)
+@click.option("--resume", is_flag=True, help="Continue an interrupted run.")
+def summary(max_summaries, input, output, workers, resume):
+    from summary import OpenAISummarizer, create_summary_cache
+
+    article_list = read_articles(input)
 
-        if len(summarized_article_list) >= max_summaries:
-            break
+    with ArticleCheckpoint(
+        output, resume=resume, fields=SUMMARY_FIELDS
+    ) as checkpoint:
+        remaining = max_summaries - len(checkpoint.articles)
+        if remaining <= 0:
+            return
+        done_ids = checkpoint.done_ids
+        article_list = [a for a in article_list if a.source_id not in done_ids]
 
-    with open(output, "w") as f:
-        f.write(json.dumps([a.asdict() for a in summarized_article_list]))
+        with OpenAISummarizer(cache=create_summary_cache()) as summarizer:
+            for article in summarizer.iter_summaries(
+                TextStore().load(article_list), remaining, max_workers=workers
+            ):
+                checkpoint.append(article)
+                article.text_list = None
+    if summarizer.cache is not None:
+        logging.info("Summary cache: %s", summarizer.cache.stats())
+
+
+@cli.command()
+@click.argument("feedname")
+@click.option("--data-dir", default="data")
+@click.option("--force", is_flag=True, help="Rebuild even if the library is current.")
+@click.option("--days", default=LIBRARY_DATE_PLUG_DAYS, type=int)
+def prepare(feedname, data_dir, force, days):
+    """Synthesize the phrases every episode of a feed repeats, for compose to reuse.
+
+    That includes the date plug of each of the next `days` days.
+    """
+    from segments import SegmentLibrary
+    from text_to_speech import TextToSpeech, create_cache
+
+    today = datetime.datetime.now(tz=pytz.timezone(TIMEZONE)).date()
+    dates = [today + datetime.timedelta(days=idx) for idx in range(days)]
+    tts = TextToSpeech(cache=create_cache())
+    library = SegmentLibrary(feedname, data_dir, voice=tts.voice, rate=tts.rate)
+    if library.covers(dates) and not force:
+        logging.info("Segment library is up to date: %s", library.path)
+        return
+    library.build(tts, dates)
 
 
 @cli.command()
@@ -73,20 +183,169 @@ def summary(max_summaries, input, output):
 @click.option("--data-dir", default="data")
 @click.option("--audio-output", default="output.mp3")
 @click.option("--note-output", default="output.txt")
-def compose(feedname, input, data_dir, audio_output, note_output):
-    with open(input, "r") as f:
-        article_list = [Article.fromdict(a) for a in json.loads(f.read())]
+@click.option("--concurrency", default=TTS_CONCURRENCY, type=int)
+@click.option("--keep-wavs", is_flag=True, help="Write segment WAVs to the data dir.")
+def compose(
+    feedname, input, data_dir, audio_output, note_output, concurrency, keep_wavs
+):
+    from composer import Composer
+
+    # A resumed summary run may have appended stories out of rank order.
+    article_list = sorted(read_articles(input), key=lambda a: a.source_rank)
 
     date = datetime.datetime.now(tz=pytz.timezone(TIMEZONE))
-    composer = Composer(feedname, date, data_dir)
+    composer = Composer(
+        feedname, date, data_dir, concurrency=concurrency, write_files=keep_wavs
+    )
     composer.compose(article_list, output_file=audio_output, note_file=note_output)
 
+    # The texts are kept a while, for summary runs again on the same stories.
+    TextStore().prune()
+
+
+@cli.command()
+@click.argument("feedname")
+@click.option("--max-stories", default=MAX_NUM_STORIES)
+@click.option("--max-summaries", default=MAX_NUM_SUMMARIES)
+@click.option("--data-dir", default="data")
+@click.option("--audio-output", default="output.mp3")
+@click.option("--note-output", default="output.txt")
+@click.option("--workers", default=PARSE_NUM_WORKERS, type=int)
+@click.option("--summary-workers", default=SUMMARY_NUM_WORKERS, type=int)
+@click.option("--concurrency", default=TTS_CONCURRENCY, type=int)
+@click.option("--podcast-id", help="Publish the episode, uploading as it is encoded.")
+@click.option("--keep-duplicates", is_flag=True, help="Keep near-duplicate stories.")
+def run(
+    feedname,
+    max_stories,
+    max_summaries,
+    data_dir,
+    audio_output,
+    note_output,
+    workers,
+    summary_workers,
+    concurrency,
+    podcast_id,
+    keep_duplicates,
+):
+    """Crawl, summarize and compose in one streaming pipeline."""
+    from audio import EncoderSettings
+    from composer import Composer
+    from crawler import HackerNewsCrawler
+    from crawler.index import CrawlIndex
+    from dedup import Deduplicator
+    from pipeline import Pipeline
+    from summary import OpenAISummarizer, create_summary_cache
+
+    date = datetime.datetime.now(tz=pytz.timezone(TIMEZONE))
+    publishing = podcast_id and not SKIP_PUBLISH
+    # The upload reads the audio as it is encoded, see CastosPodcast.
+    encoder = EncoderSettings.for_file(audio_output, streamable=publishing)
+
+    def compose_episode():
+        with create_parser(workers) as parser, OpenAISummarizer(
+            cache=create_summary_cache()
+        ) as summarizer:
+            pipeline = Pipeline(
+                HackerNewsCrawler(
+                    parser,
+                    num_workers=workers,
+                    index=CrawlIndex(),
+                    dedup=None if keep_duplicates else Deduplicator(),
+                ),
+                summarizer,
+                Composer(
+                    feedname,
+                    date,
+                    data_dir,
+                    concurrency=concurrency,
+                    encoder=encoder,
+                ),
+                summary_workers=summary_workers,
+            )
+            pipeline.run(
+                max_stories,
+                max_summaries,
+                output_file=audio_output,
+                note_file=note_output,
+            )
+
+    if not publishing:
+        compose_episode()
+        return
+
+    from podcast.castos import CastosPodcast
+
+    CastosPodcast().publish_while_writing(
+        podcast_id,
+        date.strftime("%A, %B %d"),
+        note_output,
+        audio_output,
+        compose_episode,
+        progress=log_upload_progress,
+    )
+
+
+@cli.command()
+@click.argument("config")
+@click.option("--output-dir", default="episodes")
+@click.option("--workers", default=PARSE_NUM_WORKERS, type=int)
+@click.option("--parse-timeout", default=PARSE_TIMEOUT, type=float)
+@click.option("--summary-workers", default=SUMMARY_NUM_WORKERS, type=int)
+@click.option("--concurrency", default=TTS_CONCURRENCY, type=int)
+@click.option("--feed-workers", default=FEED_NUM_WORKERS, type=int)
+def batch(
+    config,
+    output_dir,
+    workers,
+    parse_timeout,
+    summary_workers,
+    concurrency,
+    feed_workers,
+):
+    """Run every feed of a JSON config in one process, sharing parsers and caches."""
+    from batch import BatchRunner, load_feeds
+    from crawler.hackernews import create_session
+    from crawler.index import CrawlIndex
+    from podcast.castos import CastosPodcast
+    from summary import OpenAISummarizer, create_summary_cache
+    from text_to_speech import TextToSpeech, create_cache
+
+    feeds = load_feeds(config)
+    date = datetime.datetime.now(tz=pytz.timezone(TIMEZONE))
+    # Every feed crawls with `workers` threads at once, all on the one browser.
+    session = create_session(workers * feed_workers)
+    with create_parser(
+        workers * feed_workers, session=session, parse_timeout=parse_timeout
+    ) as parser, OpenAISummarizer(
+        cache=create_summary_cache()
+    ) as summarizer:
+        runner = BatchRunner(
+            parser,
+            summarizer,
+            TextToSpeech(cache=create_cache()),
+            session=session,
+            index=CrawlIndex(),
+            podcast=None if SKIP_PUBLISH else CastosPodcast(session=session),
+            parse_workers=workers,
+            parse_timeout=parse_timeout,
+            summary_workers=summary_workers,
+            concurrency=concurrency,
+            feed_workers=feed_workers,
+            output_dir=output_dir,
+        )
+        errors = runner.run(feeds, date)
+    if errors:
+        raise click.ClickException(f"Feeds failed: {', '.join(errors)}")
+
 
 @cli.command()
 @click.argument("podcast-id")
 @click.argument("audio-path")
 @click.argument("note_path")
 def publish(podcast_id, audio_path, note_path):
+    from podcast.castos import CastosPodcast
+
     podcast_host = CastosPodcast()
 
     date = datetime.datetime.now(tz=pytz.timezone(TIMEZONE))
@@ -97,7 +356,16 @@ def publish(podcast_id, audio_path, note_path):
         title,
         note_path,
         audio_path,
+        progress=log_upload_progress,
     )
 
+
+def log_upload_progress(num_bytes, total):
+    # Called for every chunk, only log about once per megabyte.
+    if num_bytes // 2**20 != getattr(log_upload_progress, "last_mb", None):
+        log_upload_progress.last_mb = num_bytes // 2**20
+        logging.info("Uploaded %d of %s bytes", num_bytes, total or "?")
+
+
 if __name__ == '__main__':
     cli()
\ No newline at end of file
@@ -0,0 +1,124 @@
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+
+
+class Metrics:
+    """Timing spans and counters collected across a run, safe to use from threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            # name -> {"count", "total", "max"} in seconds
+            self.spans = {}
+            self.counters = {}
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            stats = self.spans.setdefault(
+                name, {"count": 0, "total": 0.0, "max": 0.0}
+            )
+            stats["count"] += 1
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def timed(self, name: str):
+        """Decorate a function so that every call is recorded as a span."""
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def timed_iter(self, name: str, iterable: Iterable) -> Iterator:
+        """Record the time spent producing items, not the time the consumer holds them."""
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+                yield item
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "started": self.started,
+                "duration": time.time() - self.started,
+                "spans": {name: dict(stats) for name, stats in self.spans.items()},
+                "counters": dict(self.counters),
+            }
+
+    def write_json(self, path: str):
+        _write_atomic(path, json.dumps(self.report(), indent=2, sort_keys=True))
+
+    def write_prometheus(self, path: str):
+        """Write the report in the Prometheus text format, for textfile collectors."""
+        report = self.report()
+        lines = [
+            "# TYPE pipeline_span_seconds summary",
+        ]
+        spans = sorted(report["spans"].items())
+        for name, stats in spans:
+            label = f'{{span="{name}"}}'
+            lines.append(f"pipeline_span_seconds_count{label} {stats['count']}")
+            lines.append(f"pipeline_span_seconds_sum{label} {stats['total']}")
+        lines.append("# TYPE pipeline_span_max_seconds gauge")
+        for name, stats in spans:
+            lines.append(f'pipeline_span_max_seconds{{span="{name}"}} {stats["max"]}')
+        # The text format types the sample name, OpenMetrics would drop _total.
+        lines.append("# TYPE pipeline_events_total counter")
+        for name, value in sorted(report["counters"].items()):
+            lines.append(f'pipeline_events_total{{name="{name}"}} {value}')
+        lines.append("# TYPE pipeline_run_duration_seconds gauge")
+        lines.append(f"pipeline_run_duration_seconds {report['duration']}")
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+
+def _write_atomic(path: str, content: str):
+    # The textfile collector may read at any time, never let it see half a file.
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+METRICS = Metrics()
@@ -0,0 +1,138 @@
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from composer import Composer
+from crawler.base import BaseCrawler
+from dtos import Article
+from summary import SUMMARY_NUM_WORKERS, OpenAISummarizer
+
+PIPELINE_QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+class Pipeline:
+    """Crawl, summarize and synthesize articles as a streaming pipeline.
+
+    Each stage hands articles to the next through a bounded queue, so the
+    first story is summarized and synthesized while later ones are still being
+    crawled. The episode is assembled once the last story is ready, with the
+    same rank order and limits as running the commands one after another.
+    """
+
+    def __init__(
+        self,
+        crawler: BaseCrawler,
+        summarizer: OpenAISummarizer,
+        composer: Composer,
+        queue_size: int = PIPELINE_QUEUE_SIZE,
+        summary_workers: int = SUMMARY_NUM_WORKERS,
+    ):
+        self.crawler = crawler
+        self.summarizer = summarizer
+        self.composer = composer
+        self.queue_size = queue_size
+        self.summary_workers = summary_workers
+
+    def run(
+        self,
+        max_stories: int,
+        max_summaries: int,
+        output_file: str = "output.mp3",
+        note_file: str = "notes.txt",
+    ) -> List[Article]:
+        crawled = queue.Queue(maxsize=self.queue_size)
+        summarized = queue.Queue()
+        stop = threading.Event()
+        errors = []
+
+        producer = threading.Thread(
+            target=self._crawl, args=(max_stories, crawled, stop, errors)
+        )
+        workers = [
+            threading.Thread(
+                target=self._summarize, args=(crawled, summarized, stop)
+            )
+            for _ in range(self.summary_workers)
+        ]
+        for thread in [producer] + workers:
+            thread.start()
+
+        try:
+            article_list = self._collect(summarized, max_summaries)
+        finally:
+            stop.set()
+
+        # Workers keep draining the queue, skipping the work once stopped, so
+        # the producer always gets to send them their end markers.
+        for thread in [producer] + workers:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+        self.composer.compose(
+            article_list, output_file=output_file, note_file=note_file
+        )
+        return article_list
+
+    def _collect(self, summarized, max_summaries) -> List[Article]:
+        """Take summarized articles in rank order and synthesize each one."""
+        article_list = []
+        with ThreadPoolExecutor(max_workers=self.composer.concurrency) as executor:
+            synthesized = []
+            # seq -> summarized article or None, until its turn comes.
+            results = {}
+            next_seq = 0
+            num_done = 0
+            while (
+                num_done < self.summary_workers and len(article_list) < max_summaries
+            ):
+                item = summarized.get()
+                if item is _DONE:
+                    num_done += 1
+                    continue
+                seq, article = item
+                results[seq] = article
+                while next_seq in results and len(article_list) < max_summaries:
+                    article = results.pop(next_seq)
+                    next_seq += 1
+                    if article is not None:
+                        article_list.append(article)
+                        synthesized.append(
+                            executor.submit(self.composer.prepare_story, article)
+                        )
+            for future in synthesized:
+                future.result()
+        return article_list
+
+    def _crawl(self, max_stories, crawled, stop, errors):
+        articles = self.crawler.iter_articles(max_stories)
+        try:
+            for seq, article in enumerate(articles):
+                if stop.is_set():
+                    break
+                crawled.put((seq, article))
+        except Exception as e:
+            logging.exception("Crawl stage failed")
+            errors.append(e)
+        finally:
+            articles.close()
+            for _ in range(self.summary_workers):
+                crawled.put(_DONE)
+
+    def _summarize(self, crawled, summarized, stop):
+        while True:
+            item = crawled.get()
+            if item is _DONE:
+                break
+            seq, article = item
+            if stop.is_set():
+                article = None
+            elif not self.summarizer.summarize_article(article):
+                self.crawler.forget(article)
+                article = None
+            summarized.put((seq, article))
+        summarized.put(_DONE)
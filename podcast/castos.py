@@ -1,37 +1,239 @@
+import logging
+import mimetypes
 import os
+import threading
+import time
+import uuid
+from typing import Callable, Iterator, Union
+
 import requests
 
-from requests_toolbelt.multipart.encoder import MultipartEncoder
+from metrics import METRICS
+
+from requests_toolbelt.multipart.encoder import (
+    MultipartEncoder,
+    MultipartEncoderMonitor,
+)
 
-CASTOS_BASE_URL = "https://app.castos.com/api/v2"
+CASTOS_BASE_URL = os.environ.get(
+    "CASTOS_BASE_URL", "https://app.castos.com/api/v2"
+)
 CASTOS_API_TOKEN = os.environ.get("CASTOS_API_TOKEN")
+CASTOS_MAX_RETRIES = 3
+CASTOS_RETRY_BASE_DELAY = 2.0
+CASTOS_TIMEOUT = 300
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_POLL_INTERVAL = 0.2
+
+
+class GrowingFile:
+    """A file that another thread, e.g. the audio encoder, is still writing.
+
+    The writer calls `finish` once the file is complete, or `fail` if it
+    gave up, so that a reader streaming the file knows when to stop.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.failed = False
+        self._done = threading.Event()
+
+    def finish(self):
+        self._done.set()
+
+    def fail(self):
+        self.failed = True
+        self._done.set()
+
+    def wait_started(self):
+        """Wait until the file exists or the writer is done."""
+        while not os.path.exists(self.path) and not self._done.is_set():
+            self._done.wait(UPLOAD_POLL_INTERVAL)
+
+    def iter_chunks(self, chunk_size: int = UPLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+        self.wait_started()
+        if self.failed:
+            raise IOError(f"Writing {self.path} failed")
+        with open(self.path, "rb") as f:
+            while True:
+                # Check before reading, so the last read after `finish` gets all.
+                done = self._done.is_set()
+                chunk = f.read(chunk_size)
+                if chunk:
+                    yield chunk
+                elif done:
+                    break
+                else:
+                    self._done.wait(UPLOAD_POLL_INTERVAL)
+        if self.failed:
+            raise IOError(f"Writing {self.path} failed")
 
 
 class CastosPodcast:
-    def __init__(self):
-        pass
+    def __init__(
+        self,
+        session: requests.Session = None,
+        max_retries: int = CASTOS_MAX_RETRIES,
+    ):
+        self.session = session or requests.Session()
+        self.max_retries = max_retries
 
     def get_episode(self, podcast_id, episode_id):
-        req = requests.get(
+        req = self.session.get(
             f"{CASTOS_BASE_URL}/podcasts/{podcast_id}/episodes/{episode_id}",
             params={"token": CASTOS_API_TOKEN},
         )
         return req.json()
 
-    def create_episode(self, podcast_id, title, show_note_path, file_path):
-        show_note = open(show_note_path).read()
-        payload = MultipartEncoder(
-            fields={
-                "post_title": title,
-                "post_content": show_note,
-                "episode_file": (file_path, open(file_path, "rb"), "audio/mpeg"),
-            }
-        )
-        req = requests.post(
+    @METRICS.timed("CastosPodcast.create_episode")
+    def create_episode(
+        self,
+        podcast_id,
+        title,
+        show_note_path,
+        file_path: Union[str, GrowingFile],
+        progress: Callable[[int, Union[int, None]], None] = None,
+    ):
+        """Upload an episode, retrying with backoff on network and server errors.
+
+        `file_path` may be a `GrowingFile`, the upload then starts while the
+        file is still being written and is sent with chunked encoding.
+        `progress` is called with the bytes sent so far and the total size,
+        None while the total is not known yet.
+        """
+        if isinstance(file_path, GrowingFile):
+            # The show notes are written before the audio, wait for both.
+            file_path.wait_started()
+            if file_path.failed:
+                raise IOError(f"Writing {file_path.path} failed")
+        with open(show_note_path) as f:
+            show_note = f.read()
+        fields = {"post_title": title, "post_content": show_note}
+
+        for attempt in range(self.max_retries + 1):
+            sent = [0]
+
+            def on_progress(num_bytes, total):
+                sent[0] = num_bytes
+                if progress is not None:
+                    progress(num_bytes, total)
+
+            try:
+                if isinstance(file_path, GrowingFile):
+                    self._post_streaming(podcast_id, fields, file_path, on_progress)
+                else:
+                    self._post_file(podcast_id, fields, file_path, on_progress)
+                METRICS.incr("upload_bytes", sent[0])
+                return
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except requests.HTTPError as e:
+                if e.response.status_code < 500 and e.response.status_code != 429:
+                    raise
+                error = e
+            METRICS.incr("upload_bytes", sent[0])
+            if attempt == self.max_retries:
+                raise error
+            delay = CASTOS_RETRY_BASE_DELAY * 2**attempt
+            logging.warning(
+                "Upload failed after %d bytes (%s), retrying in %.0fs",
+                sent[0],
+                error,
+                delay,
+            )
+            time.sleep(delay)
+
+    def publish_while_writing(
+        self,
+        podcast_id,
+        title,
+        show_note_path,
+        file_path: str,
+        write: Callable[[], None],
+        progress: Callable[[int, Union[int, None]], None] = None,
+    ):
+        """Run `write` in a thread and upload `file_path` as it is written.
+
+        `write` must write the show notes before it creates the audio file.
+        """
+        # The upload starts as soon as the file exists, not a stale copy.
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        growing = GrowingFile(file_path)
+        errors = []
+
+        def produce():
+            try:
+                write()
+            except Exception as e:
+                errors.append(e)
+                growing.fail()
+            else:
+                growing.finish()
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        try:
+            self.create_episode(
+                podcast_id, title, show_note_path, growing, progress=progress
+            )
+        finally:
+            producer.join()
+            # A failed write also fails the upload, report the cause.
+            if errors:
+                raise errors[0]
+
+    def _post_file(self, podcast_id, fields, file_path, on_progress):
+        with open(file_path, "rb") as f:
+            payload = MultipartEncoderMonitor(
+                MultipartEncoder(
+                    fields=dict(
+                        fields,
+                        episode_file=(file_path, f, _content_type(file_path)),
+                    )
+                ),
+                lambda monitor: on_progress(monitor.bytes_read, monitor.len),
+            )
+            req = self.session.post(
+                f"{CASTOS_BASE_URL}/podcasts/{podcast_id}/episodes/",
+                params={"token": CASTOS_API_TOKEN},
+                data=payload,
+                headers={"Content-Type": payload.content_type},
+                timeout=CASTOS_TIMEOUT,
+            )
+        req.raise_for_status()
+
+    def _post_streaming(self, podcast_id, fields, growing_file, on_progress):
+        boundary = uuid.uuid4().hex
+
+        def body():
+            head = b"".join(
+                _form_part(boundary, name, value.encode("utf-8"))
+                for name, value in fields.items()
+            )
+            head += (
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="episode_file"; '
+                f'filename="{growing_file.path}"\r\n'
+                f"Content-Type: {_content_type(growing_file.path)}\r\n\r\n"
+            ).encode("utf-8")
+            num_bytes = len(head)
+            yield head
+            for chunk in growing_file.iter_chunks():
+                num_bytes += len(chunk)
+                on_progress(num_bytes, None)
+                yield chunk
+            tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+            num_bytes += len(tail)
+            on_progress(num_bytes, num_bytes)
+            yield tail
+
+        req = self.session.post(
             f"{CASTOS_BASE_URL}/podcasts/{podcast_id}/episodes/",
             params={"token": CASTOS_API_TOKEN},
-            data=payload,
-            headers={"Content-Type": payload.content_type},
+            data=body(),
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+            timeout=CASTOS_TIMEOUT,
         )
         req.raise_for_status()
 
@@ -42,10 +244,21 @@ class CastosPodcast:
                 "post_content": show_note,
             }
         )
-        req = requests.post(
+        req = self.session.post(
             f"{CASTOS_BASE_URL}/podcasts/{podcast_id}/episodes/{episode_id}",
             params={"token": CASTOS_API_TOKEN},
             data=payload,
             headers={"Content-Type": payload.content_type},
         )
         req.raise_for_status()
+
+
+def _form_part(boundary: str, name: str, value: bytes) -> bytes:
+    return (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+    ).encode("utf-8") + value + b"\r\n"
+
+
+def _content_type(path: str) -> str:
+    return mimetypes.guess_type(path)[0] or "audio/mpeg"
@@ -0,0 +1,187 @@
+import calendar
+import json
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Dict, List, Sequence, Union
+
+from audio import normalize_wav
+from cache import hash_key
+from text_to_speech import TTS_RATE, TTS_VOICE, TextToSpeech
+
+# Bump to rebuild every library, e.g. when clips are processed differently.
+LIBRARY_FORMAT_VERSION = "1"
+LIBRARY_DIR = "library"
+LIBRARY_MANIFEST = "manifest.json"
+LIBRARY_CONCURRENCY = 4
+# Days of date plugs `prepare` synthesizes ahead, a year from its run.
+LIBRARY_DATE_PLUG_DAYS = 366
+
+OPENING_TEMPLATE = "Welcome to {} daily!"
+DATE_TEMPLATE = "Today is {}"
+SUMMARY_PROMPT = "This is a summary of the story."
+CLOSING = "That's it for today's update. Thank you for listening!"
+NUMBERED_FILLER_TEMPLATE = "Story number {}."
+NUM_NUMBERED_FILLERS = 4
+LAST_FILLER = "Last story of the day."
+NEXT_FILLER = "Next story."
+
+
+def filler_text(idx: int, num_stories: int) -> str:
+    if idx < NUM_NUMBERED_FILLERS:
+        return NUMBERED_FILLER_TEMPLATE.format(idx + 1)
+    if idx == num_stories - 1:
+        return LAST_FILLER
+    return NEXT_FILLER
+
+
+def date_plug_text(date: datetime) -> str:
+    """The date plug, synthesized as one phrase so that it reads as a date."""
+    return DATE_TEMPLATE.format(
+        f"{calendar.day_name[date.weekday()]}, {calendar.month_name[date.month]} "
+        f"{date.day}"
+    )
+
+
+def library_phrases(feed_name: str) -> List[str]:
+    """Every phrase of an episode that depends on neither its stories nor its date."""
+    return (
+        [OPENING_TEMPLATE.format(feed_name), SUMMARY_PROMPT, CLOSING]
+        + [
+            NUMBERED_FILLER_TEMPLATE.format(idx + 1)
+            for idx in range(NUM_NUMBERED_FILLERS)
+        ]
+        + [LAST_FILLER, NEXT_FILLER]
+    )
+
+
+class SegmentLibrary:
+    """Pre-synthesized, normalized audio for the phrases a feed repeats daily.
+
+    A library lives in `<data_dir>/<feed>/library/<version>`, where the
+    version is a hash of the voice, the rate and the phrases. Changing any
+    of them makes `compose` ignore the old library until `prepare` builds a
+    new one, rather than mixing voices in an episode.
+    """
+
+    def __init__(
+        self,
+        feed_name: str,
+        data_dir: str,
+        voice: str = TTS_VOICE,
+        rate: str = TTS_RATE,
+    ):
+        self.feed_name = feed_name
+        self.voice = voice
+        self.rate = rate
+        self.phrases = library_phrases(feed_name)
+        key = hash_key(LIBRARY_FORMAT_VERSION, voice, rate, *self.phrases)
+        self.version = key[:12]
+        self.path = os.path.join(
+            os.path.dirname(__file__), data_dir, feed_name, LIBRARY_DIR, self.version
+        )
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.path, LIBRARY_MANIFEST))
+
+    def covers(self, dates: Sequence[date]) -> bool:
+        """Whether the library is built with a date plug for each of `dates`."""
+        if not self.exists():
+            return False
+        plugs = load_manifest(self.path).get("dates", {})
+        return all(day.isoformat() in plugs for day in dates)
+
+    def build(
+        self,
+        tts: TextToSpeech,
+        dates: Sequence[date] = (),
+        concurrency: int = LIBRARY_CONCURRENCY,
+    ):
+        """Synthesize every phrase and date plug, write the library in one rename."""
+        plugs = [date_plug_text(day) for day in dates]
+        texts = self.phrases + plugs
+        # One request per phrase, short clips split from a batch can clip words.
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            audio_list = list(executor.map(tts.synthesize, texts))
+        for text, audio_data in zip(texts, audio_list):
+            if audio_data is None:
+                raise RuntimeError(f"Failed to synthesize speech for: {text}")
+
+        parent = os.path.dirname(self.path)
+        os.makedirs(parent, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+        try:
+            clips = {}
+            for idx, (phrase, audio_data) in enumerate(zip(self.phrases, audio_list)):
+                clips[phrase] = f"{idx:03d}.wav"
+                with open(os.path.join(tmp_dir, clips[phrase]), "wb") as f:
+                    f.write(normalize_wav(audio_data))
+            date_plugs = {}
+            for day, audio_data in zip(dates, audio_list[len(self.phrases) :]):
+                filename = f"date-{day.isoformat()}.wav"
+                date_plugs[day.isoformat()] = filename
+                with open(os.path.join(tmp_dir, filename), "wb") as f:
+                    f.write(normalize_wav(audio_data))
+            with open(os.path.join(tmp_dir, LIBRARY_MANIFEST), "w") as f:
+                json.dump(
+                    {
+                        "voice": self.voice,
+                        "rate": self.rate,
+                        "clips": clips,
+                        "dates": date_plugs,
+                    },
+                    f,
+                    indent=2,
+                )
+            if os.path.exists(self.path):
+                shutil.rmtree(self.path)
+            os.rename(tmp_dir, self.path)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        logging.info("Built segment library: %s", self.path)
+
+    def load(self) -> Dict[str, bytes]:
+        """Return phrase -> WAV bytes, an empty dict if the library is not built."""
+        if not self.exists():
+            logging.warning(
+                "No segment library for %s, run prepare to build it", self.feed_name
+            )
+            return {}
+        return load_clips(self.path)
+
+    def load_date_plug(self, day: date) -> Union[bytes, None]:
+        """Return the WAV bytes of the date plug of a day, None if it is not built."""
+        if not self.exists():
+            return None
+        filename = load_manifest(self.path).get("dates", {}).get(day.isoformat())
+        if filename is None:
+            logging.warning(
+                "No date plug for %s in the library, run prepare to extend it", day
+            )
+            return None
+        with open(os.path.join(self.path, filename), "rb") as f:
+            return f.read()
+
+
+def load_manifest(path: str) -> dict:
+    with open(os.path.join(path, LIBRARY_MANIFEST)) as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=16)
+def load_clips(path: str) -> Dict[str, bytes]:
+    """Read the phrases of a library into memory once per process.
+
+    Date plugs are left on disk, only the one of an episode is read.
+    """
+    clips = load_manifest(path)["clips"]
+    result = {}
+    for phrase, filename in clips.items():
+        with open(os.path.join(path, filename), "rb") as f:
+            result[phrase] = f.read()
+    return result
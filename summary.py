@@ -1,16 +1,43 @@
+import bisect
+import hashlib
 import logging
 import os
-from typing import List
+import random
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterator, List, Tuple
 
 import openai
-from transformers import GPT2TokenizerFast
+
+from cache import SQLiteCache, hash_key
+from dtos import Article
+from metrics import METRICS
 
 
 OPENAI_MOCK = os.getenv("OPENAI_MOCK", "False").lower() == "true"
+OPENAI_MOCK_LATENCY = float(os.getenv("OPENAI_MOCK_LATENCY", "0"))
+OPENAI_API_BASE = os.environ.get("OPENAI_API_BASE")
 OPENAI_ORG_ID = os.environ.get("OPENAI_ORG_ID")
 OPENAI_API_TOKEN = os.environ.get("OPENAI_API_TOKEN")
+OPENAI_MODEL = "gpt-3.5-turbo"
+OPENAI_SYSTEM_PROMPT = "You are a helpful assitant that summarize longer text into podcast ready scripts."
+OPENAI_USER_PROMPT = "Summarize this:\n{text}"
 OPENAI_MAX_TOKEN = 4096
 OPENAI_MAX_RESPONSE_TOKEN = 256
+OPENAI_MAX_CONCURRENCY = 8
+# Articles summarized at a time, their chunks share OPENAI_MAX_CONCURRENCY.
+SUMMARY_NUM_WORKERS = 4
+# 0 removes the bound on the request rate, e.g. for accounts with higher limits.
+OPENAI_MAX_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_MAX_REQUESTS_PER_MINUTE", "60"))
+OPENAI_MAX_RETRIES = 5
+OPENAI_RETRY_BASE_DELAY = 1.0
+TOKEN_CACHE_SIZE = 1024
+SUMMARY_CACHE_PATH = os.environ.get("SUMMARY_CACHE_PATH", ".cache/summaries.sqlite")
+SUMMARY_CACHE_TTL = float(os.environ.get("SUMMARY_CACHE_TTL", 30 * 24 * 3600))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.environ.get("SUMMARY_CACHE_MAX_ENTRIES", 100000))
 
 
 def openai_authenticate():
@@ -18,72 +45,169 @@ def openai_authenticate():
     logging.info("Authenticating with OpenAI")
     openai.api_key = OPENAI_API_TOKEN
     openai.organization = OPENAI_ORG_ID
+    if OPENAI_API_BASE:
+        openai.api_base = OPENAI_API_BASE
 
 
+@METRICS.timed("openai_summarize_text")
 def openai_summarize_text(text):
     """Summarize text using OpenAI."""
     logging.info("Summarizing text with OpenAI")
     if OPENAI_MOCK:
+        time.sleep(OPENAI_MOCK_LATENCY)
         return "This is a mock summary."
 
     prompt = [
         {
             "role": "system",
-            "content": "You are a helpful assitant that summarize longer text into podcast ready scripts.",
+            "content": OPENAI_SYSTEM_PROMPT,
         },
         {
             "role": "user",
-            "content": f"Summarize this:\n{text}",
+            "content": OPENAI_USER_PROMPT.format(text=text),
         },
     ]
     response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
+        model=OPENAI_MODEL,
         messages=prompt,
-        max_tokens=256,
+        max_tokens=OPENAI_MAX_RESPONSE_TOKEN,
     )
+    METRICS.incr("openai_prompt_tokens", response.usage["prompt_tokens"])
+    METRICS.incr("openai_completion_tokens", response.usage["completion_tokens"])
     return response.choices[0].message["content"]
 
 
+@lru_cache(maxsize=None)
+def get_tokenizer(name: str = "gpt2"):
+    """Load a tokenizer on first use, transformers is slow to import."""
+    from transformers import GPT2TokenizerFast
+
+    return GPT2TokenizerFast.from_pretrained(name)
+
+
+class RateLimiter:
+    """Bound the number of requests in flight and the request rate, across threads.
+
+    A `max_requests_per_minute` of 0 only bounds the requests in flight.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = OPENAI_MAX_CONCURRENCY,
+        max_requests_per_minute: int = OPENAI_MAX_REQUESTS_PER_MINUTE,
+    ):
+        self.interval = (
+            60.0 / max_requests_per_minute if max_requests_per_minute else 0.0
+        )
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._next_time = time.monotonic()
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._semaphore.release()
+
+    def slow_down(self, delay: float):
+        """Push back every later request, e.g. after a rate limit error."""
+        with self._lock:
+            self._next_time = max(self._next_time, time.monotonic() + delay)
+
+
+def call_with_retry(
+    func: Callable,
+    *args,
+    rate_limiter: RateLimiter = None,
+    max_retries: int = OPENAI_MAX_RETRIES,
+    base_delay: float = OPENAI_RETRY_BASE_DELAY,
+):
+    """Call func under the rate limiter, backing off on transient OpenAI errors."""
+    for attempt in range(max_retries + 1):
+        try:
+            if rate_limiter is None:
+                return func(*args)
+            with rate_limiter:
+                return func(*args)
+        except (
+            openai.error.RateLimitError,
+            openai.error.ServiceUnavailableError,
+            openai.error.APIConnectionError,
+            openai.error.Timeout,
+        ) as e:
+            if attempt == max_retries:
+                raise
+            delay = base_delay * 2**attempt * (1 + random.random())
+            logging.warning("OpenAI request failed (%s), retrying in %.1fs", e, delay)
+            if rate_limiter is not None and isinstance(e, openai.error.RateLimitError):
+                rate_limiter.slow_down(delay)
+            time.sleep(delay)
+
+
 class OpenAISummarizer:
     def __init__(
         self,
-        tokenizer=GPT2TokenizerFast.from_pretrained("gpt2"),
+        tokenizer=None,
         max_length=OPENAI_MAX_TOKEN - OPENAI_MAX_RESPONSE_TOKEN,
+        rate_limiter: RateLimiter = None,
+        max_concurrency: int = OPENAI_MAX_CONCURRENCY,
+        cache: SQLiteCache = None,
     ):
-        self.tokenizer = tokenizer
+        self._tokenizer = tokenizer
+        # Mock summaries must never end up in a cache shared with real runs.
+        self.cache = None if OPENAI_MOCK else cache
         self.max_length = max_length
+        # Mock summaries send no requests, so they are not rate limited either.
+        if rate_limiter is None and not OPENAI_MOCK:
+            rate_limiter = RateLimiter(max_concurrency)
+        self.rate_limiter = rate_limiter
+        # Chunks of every article share this pool, the rate limiter is what
+        # bounds the requests actually in flight.
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        # sha1 of a text -> its token offsets, most recently used last.
+        self._offsets = OrderedDict()
+        self._offsets_lock = threading.Lock()
         openai_authenticate()
 
-    def break_down_text(self, text) -> List[str]:
-        text_len = self.tokenizer(text, return_length=True).length[0]
-        if text_len > self.max_length:
-            # TODO: This is a naive way of breaking down text. Improve it.
-            separator = ". "
-            splits = text.split(". ")
-            if len(splits) == 1:
-                splits = text.split(" ")
-                separator = " "
-            mid = len(splits) // 2
-            first = separator.join(splits[:mid])
-            second = separator.join(splits[mid:])
-            return self.break_down_text(first) + self.break_down_text(second)
-        else:
-            return [text]
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = get_tokenizer()
+        return self._tokenizer
 
     def get_chunks(self, text_list) -> List[str]:
-        # first, break up the text into chunks that are less than the max length
-        breakdown_chunk_list = []
-        for text in text_list:
-            breakdown_chunk_list += self.break_down_text(text)
+        """Split and pack texts into chunks of at most `max_length` tokens.
+
+        Each text is tokenized once, pieces are cut and counted on the token
+        offsets rather than by re-tokenizing them.
+        """
+        # first, break up the text into pieces that are less than the max length
+        pieces = []
+        for text, offsets in zip(text_list, self._tokenize(text_list)):
+            pieces += self._split(text, offsets)
 
-        # second, merge chunks that are less than the max length
+        # second, merge pieces that are less than the max length
         merged_chunk_list = []
         chunk = ""
         current_length = 0
-        for text in breakdown_chunk_list:
-            text_len = self.tokenizer(text, return_length=True).length[0]
-
-            if current_length + text_len > self.max_length:
+        for text, text_len in pieces:
+            if chunk and current_length + text_len > self.max_length:
                 merged_chunk_list.append(chunk)
                 chunk = ""
                 current_length = 0
@@ -94,14 +218,166 @@ class OpenAISummarizer:
 
         return merged_chunk_list
 
+    def _tokenize(self, text_list: List[str]) -> List[List[Tuple[int, int]]]:
+        """Return the token offsets of each text, tokenizing only unseen texts."""
+        keys = [hashlib.sha1(text.encode("utf-8")).digest() for text in text_list]
+        with self._offsets_lock:
+            return self._tokenize_locked(text_list, keys)
+
+    def _tokenize_locked(self, text_list, keys):
+        missing = {}
+        for key, text in zip(keys, text_list):
+            if key not in self._offsets:
+                missing[key] = text
+        if missing:
+            encoding = self.tokenizer(
+                list(missing.values()),
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+            )
+            for key, offsets in zip(missing, encoding["offset_mapping"]):
+                self._offsets[key] = offsets
+        result = []
+        for key in keys:
+            self._offsets.move_to_end(key)
+            result.append(self._offsets[key])
+        while len(self._offsets) > TOKEN_CACHE_SIZE:
+            self._offsets.popitem(last=False)
+        return result
+
+    def _split(self, text: str, offsets: List[Tuple[int, int]]) -> List[Tuple[str, int]]:
+        """Cut a text into (piece, token count) of at most `max_length` tokens.
+
+        Pieces end on a sentence boundary where possible, then on a word.
+        """
+        pieces = []
+        starts = [start for start, _ in offsets]
+        start_tok = 0
+        start_char = 0
+        while len(offsets) - start_tok > self.max_length:
+            window_end = starts[start_tok + self.max_length]
+            cut = text.rfind(". ", start_char, window_end) + 1
+            if cut <= start_char:
+                cut = text.rfind(" ", start_char, window_end)
+            if cut <= start_char:
+                cut = window_end
+            cut_tok = bisect.bisect_left(starts, cut, start_tok + 1)
+            pieces.append((text[start_char:cut].strip(), cut_tok - start_tok))
+            start_tok = cut_tok
+            start_char = cut
+        pieces.append((text[start_char:].strip(), len(offsets) - start_tok))
+        return pieces
+
     def summarize(self, text_list: List[str]) -> str:
-        """Summarize a list of text, recursively to bypass GPT's token limit."""
+        """Summarize a list of text, recursively to bypass GPT's token limit.
+
+        The chunks of each level are summarized in parallel.
+        """
         logging.info("Summarizing text")
 
         chunk_list = self.get_chunks(text_list)
-        summary_list = [openai_summarize_text(chunk) for chunk in chunk_list]
+        summary_list = list(self._executor.map(self._summarize_chunk, chunk_list))
 
         if len(summary_list) == 1:
             return summary_list[0]
         else:
             return self.summarize(summary_list)
+
+    def summarize_articles(
+        self,
+        article_list: List[Article],
+        max_summaries: int,
+        max_workers: int = SUMMARY_NUM_WORKERS,
+    ) -> List[Article]:
+        """Summarize articles in parallel, return the first successes in rank order.
+
+        At most `max_workers` articles are in progress at a time, and no new
+        article is started once `max_summaries` could already succeed.
+        """
+        return list(self.iter_summaries(article_list, max_summaries, max_workers))
+
+    def iter_summaries(
+        self,
+        article_list: List[Article],
+        max_summaries: int,
+        max_workers: int = SUMMARY_NUM_WORKERS,
+    ) -> Iterator[Article]:
+        """Like `summarize_articles`, but yield each article once its rank is settled."""
+        articles = iter(article_list)
+        # Ordered [article, future, ok]; ok is None while unresolved.
+        slots = []
+        num_yielded = 0
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            while True:
+                running = [s for s in slots if s[2] is None]
+                num_succeeded = sum(1 for s in slots if s[2])
+                while (
+                    len(running) < max_workers
+                    and num_yielded + num_succeeded + len(running) < max_summaries
+                ):
+                    article = next(articles, None)
+                    if article is None:
+                        break
+                    future = executor.submit(self.summarize_article, article)
+                    slot = [article, future, None]
+                    slots.append(slot)
+                    running.append(slot)
+                if not running:
+                    break
+
+                wait([s[1] for s in running], return_when=FIRST_COMPLETED)
+                for slot in running:
+                    if slot[1].done():
+                        slot[2] = slot[1].result()
+
+                while slots and slots[0][2] is not None:
+                    article, _, ok = slots.pop(0)
+                    if ok:
+                        num_yielded += 1
+                        yield article
+                    if num_yielded >= max_summaries:
+                        return
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _summarize_chunk(self, chunk: str) -> str:
+        if self.cache is None:
+            return call_with_retry(
+                openai_summarize_text, chunk, rate_limiter=self.rate_limiter
+            )
+        cache_key = hash_key(
+            OPENAI_MODEL, OPENAI_SYSTEM_PROMPT, OPENAI_USER_PROMPT, chunk
+        )
+        summary = self.cache.get(cache_key)
+        METRICS.incr("summary_cache_hits" if summary else "summary_cache_misses")
+        if summary is None:
+            summary = call_with_retry(
+                openai_summarize_text, chunk, rate_limiter=self.rate_limiter
+            )
+            if summary:
+                self.cache.put(cache_key, summary)
+        return summary
+
+    def summarize_article(self, article: Article) -> bool:
+        """Set the summary of an article, return whether it succeeded."""
+        try:
+            summary = self.summarize(article.text_list)
+        except Exception:
+            logging.exception("Failed to summarize story: %s", article.source_id)
+            return False
+        if not summary:
+            logging.warning(
+                "Failed to generate summary for story: %s", article.source_id
+            )
+            return False
+        article.summary = summary
+        return True
+
+
+def create_summary_cache(
+    path: str = SUMMARY_CACHE_PATH,
+    ttl: float = SUMMARY_CACHE_TTL,
+    max_entries: int = SUMMARY_CACHE_MAX_ENTRIES,
+) -> SQLiteCache:
+    return SQLiteCache(path, ttl, max_entries)
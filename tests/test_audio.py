@@ -0,0 +1,30 @@
+import pytest
+
+from audio import EncoderSettings
+
+
+@pytest.mark.parametrize(
+    "path, codec, container",
+    [
+        ("episode.mp3", "mp3", "mp3"),
+        ("episode.aac", "aac", "adts"),
+        ("episode.M4A", "aac", "ipod"),
+        ("episode.opus", "opus", "ogg"),
+        ("episode.ogg", "opus", "ogg"),
+    ],
+)
+def test_codec_and_container_follow_the_extension(path, codec, container):
+    encoder = EncoderSettings.for_file(path)
+    assert encoder.codec == codec
+    assert encoder.ffmpeg_args()[-2:] == ["-f", container]
+
+
+def test_unknown_extensions_are_rejected():
+    with pytest.raises(ValueError):
+        EncoderSettings.for_file("episode.wav")
+
+
+def test_streamable_files_have_no_trailing_header():
+    assert "-write_xing" in EncoderSettings.for_file("a.mp3", True).ffmpeg_args()
+    assert "-movflags" in EncoderSettings.for_file("a.m4a", True).ffmpeg_args()
+    assert "-movflags" not in EncoderSettings.for_file("a.m4a").ffmpeg_args()
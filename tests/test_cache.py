@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from cache import FileCache
+
+BLOB = b"x" * 100
+
+
+def entries(cache_dir):
+    return sorted(name for _, _, files in os.walk(cache_dir) for name in files)
+
+
+def test_least_recently_used_entries_are_evicted_first(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=350)
+    for idx, key in enumerate(["aa1", "bb2", "cc3"]):
+        cache.put(key, BLOB)
+        # Written in order, long ago.
+        os.utime(cache.path(key), (1000 + idx, 1000 + idx))
+    assert cache.get("aa1") is not None
+
+    cache.put("dd4", BLOB)
+
+    assert entries(tmp_path) == ["aa1", "cc3", "dd4"]
+    assert cache.get_bytes("aa1") == BLOB
+
+
+def no_walk():
+    raise AssertionError("the cache directory was walked again")
+
+
+def test_eviction_frees_down_to_the_low_water_mark(tmp_path, monkeypatch):
+    cache = FileCache(str(tmp_path), max_bytes=1000, low_water=0.5)
+    for idx in range(10):
+        cache.put(f"{idx:02d}", BLOB)
+        os.utime(cache.path(f"{idx:02d}"), (1000 + idx, 1000 + idx))
+
+    cache.put("10", BLOB)
+
+    assert entries(tmp_path) == ["06", "07", "08", "09", "10"]
+    # Another entry fits without walking the directory again.
+    monkeypatch.setattr(cache, "_entries", no_walk)
+    cache.put("11", BLOB)
+    assert cache.get_bytes("11") == BLOB
+
+
+def test_failed_write_keeps_the_previous_entry(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=1000)
+    cache.put("aa1", BLOB)
+
+    with pytest.raises(TypeError):
+        cache.put("aa1", "not bytes")
+
+    assert cache.get_bytes("aa1") == BLOB
+    # The temporary file is gone, and never counted as an entry.
+    assert entries(tmp_path) == ["aa1"]
+
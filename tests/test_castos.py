@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import default
+
+import pytest
+import requests
+
+from benchmarks.fakes import FakeServices
+from podcast import castos
+from podcast.castos import CastosPodcast, GrowingFile
+
+
+def parse_form(headers, body):
+    """Return name -> bytes of the parts of a multipart/form-data body."""
+    message = BytesParser(policy=default).parsebytes(
+        b"Content-Type: " + headers["Content-Type"].encode() + b"\r\n\r\n" + body
+    )
+    return {
+        part.get_param("name", header="content-disposition"): part.get_payload(
+            decode=True
+        )
+        for part in message.iter_parts()
+    }
+
+
+@pytest.fixture
+def episode(tmp_path):
+    audio_path = tmp_path / "output.mp3"
+    audio_path.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    note_path = tmp_path / "output.txt"
+    note_path.write_text("<b>Summary:</b> notes")
+    return str(audio_path), str(note_path)
+
+
+def start_services(monkeypatch, **kwargs):
+    services = FakeServices(0, **kwargs).start()
+    monkeypatch.setattr(castos, "CASTOS_BASE_URL", services.castos_base_url)
+    monkeypatch.setattr(castos, "CASTOS_RETRY_BASE_DELAY", 0)
+    return services
+
+
+def test_create_episode_uploads_file_and_notes(monkeypatch, episode):
+    audio_path, note_path = episode
+    progress = []
+    with start_services(monkeypatch) as services:
+        CastosPodcast().create_episode(
+            "42",
+            "Sunday, October 18",
+            note_path,
+            audio_path,
+            progress=lambda *args: progress.append(args),
+        )
+
+    assert len(services.uploads) == 1
+    form = parse_form(*services.uploads[0])
+    assert form["post_title"] == b"Sunday, October 18"
+    assert form["post_content"] == b"<b>Summary:</b> notes"
+    with open(audio_path, "rb") as f:
+        assert form["episode_file"] == f.read()
+    sent, total = progress[-1]
+    assert sent == total == len(services.uploads[0][1])
+
+
+def test_create_episode_retries_server_errors(monkeypatch, episode):
+    audio_path, note_path = episode
+    with start_services(monkeypatch, upload_failures=2) as services:
+        CastosPodcast(max_retries=3).create_episode("42", "t", note_path, audio_path)
+
+    assert len(services.uploads) == 3
+    # Every attempt sends the whole file again.
+    with open(audio_path, "rb") as f:
+        data = f.read()
+    for upload in services.uploads:
+        assert parse_form(*upload)["episode_file"] == data
+
+
+def test_create_episode_gives_up_after_max_retries(monkeypatch, episode):
+    audio_path, note_path = episode
+    with start_services(monkeypatch, upload_failures=10) as services:
+        with pytest.raises(requests.HTTPError):
+            CastosPodcast(max_retries=1).create_episode(
+                "42", "t", note_path, audio_path
+            )
+
+    assert len(services.uploads) == 2
+
+
+def test_create_episode_streams_a_growing_file(monkeypatch, tmp_path, episode):
+    _, note_path = episode
+    audio_path = str(tmp_path / "growing.mp3")
+    chunks = [os.urandom(256 * 1024) for _ in range(8)]
+    growing = GrowingFile(audio_path)
+
+    def write():
+        with open(audio_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                f.flush()
+                time.sleep(0.05)
+        growing.finish()
+
+    writer = threading.Thread(target=write)
+    with start_services(monkeypatch) as services:
+        writer.start()
+        CastosPodcast().create_episode("42", "t", note_path, growing)
+        writer.join()
+
+    headers, body = services.uploads[0]
+    assert headers["Transfer-Encoding"] == "chunked"
+    assert parse_form(headers, body)["episode_file"] == b"".join(chunks)
+
+
+def test_create_episode_fails_when_the_writer_fails(monkeypatch, tmp_path, episode):
+    _, note_path = episode
+    growing = GrowingFile(str(tmp_path / "never.mp3"))
+    growing.fail()
+    with start_services(monkeypatch) as services:
+        with pytest.raises(IOError):
+            CastosPodcast().create_episode("42", "t", note_path, growing)
+
+    assert services.uploads == []
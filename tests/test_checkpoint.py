@@ -0,0 +1,52 @@
+import os
+import time
+
+from checkpoint import ArticleCheckpoint, TextStore, read_articles
+from dtos import CRAWL_FIELDS, Article
+
+
+def make_article(idx, text_list=None):
+    return Article(
+        source_name="test",
+        source_id=str(idx),
+        source_rank=idx,
+        title=f"Story {idx}",
+        url=f"https://example.com/{idx}",
+        text_list=text_list,
+    )
+
+
+def test_checkpoint_keeps_texts_in_the_store(tmp_path):
+    store = TextStore(str(tmp_path / "text"))
+    path = str(tmp_path / "stories.json")
+    with ArticleCheckpoint(path, fields=CRAWL_FIELDS, text_store=store) as checkpoint:
+        checkpoint.append(make_article(0, ["first", "second"]))
+
+    (article,) = read_articles(path)
+    assert article.text_list is None
+    assert [a.text_list for a in store.load([article])] == [["first", "second"]]
+
+
+def test_load_skips_articles_whose_text_was_pruned(tmp_path):
+    store = TextStore(str(tmp_path))
+    kept = make_article(0)
+    kept.text_ref = store.put(["kept"])
+    pruned = make_article(1)
+    pruned.text_ref = store.put(["pruned"])
+    os.remove(store._path(pruned.text_ref))
+
+    assert [a.source_id for a in store.load([kept, pruned])] == ["0"]
+    assert kept.text_list == ["kept"]
+
+
+def test_prune_deletes_texts_not_stored_recently(tmp_path):
+    store = TextStore(str(tmp_path))
+    old_key = store.put(["old"])
+    new_key = store.put(["new"])
+    past = time.time() - 3600
+    os.utime(store._path(old_key), (past, past))
+
+    store.prune(ttl=60)
+
+    assert not os.path.exists(store._path(old_key))
+    assert store.get(new_key) == ["new"]
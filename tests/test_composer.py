@@ -0,0 +1,123 @@
+import datetime
+import io
+import time
+
+import composer
+from composer import Composer
+from dtos import Article
+from segments import SegmentLibrary, date_plug_text
+from text_to_speech import FakeSpeechBackend, TextToSpeech
+
+LATENCY = 0.1
+SUMMARY = "This is a sentence of a summary that goes on for a while. " * 25
+
+
+class FakeAssembler:
+    """Record the segments appended to an episode instead of encoding them."""
+
+    episodes = []
+
+    def __init__(self, output_file, encoder=None):
+        self.segments = []
+        FakeAssembler.episodes.append(self.segments)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def append_wav(self, source: io.BytesIO):
+        self.segments.append(len(source.getvalue()))
+
+    def append_silence(self, seconds):
+        self.segments.append(seconds)
+
+    def append_jingle(self, path):
+        self.segments.append(path)
+
+
+def make_articles(num_stories):
+    return [
+        Article(
+            source_name="test",
+            source_id=str(idx),
+            source_rank=idx,
+            title=f"Story number {idx}",
+            url=f"https://example.com/{idx}",
+            summary=f"{idx}. {SUMMARY}",
+        )
+        for idx in range(num_stories)
+    ]
+
+
+def compose(tmp_path, concurrency):
+    episode = Composer(
+        "test",
+        datetime.datetime(2026, 10, 18),
+        str(tmp_path),
+        tts=TextToSpeech(
+            # Short clips, so that the time goes to the requests.
+            backend=FakeSpeechBackend(latency=LATENCY, chars_per_second=1000)
+        ),
+        concurrency=concurrency,
+        intro_jingle=None,
+        outro_jingle=None,
+    )
+    start = time.perf_counter()
+    episode.compose(
+        make_articles(8),
+        output_file=str(tmp_path / "output.mp3"),
+        note_file=str(tmp_path / "notes.txt"),
+    )
+    return time.perf_counter() - start
+
+
+def test_segments_are_synthesized_concurrently(tmp_path, monkeypatch):
+    monkeypatch.setattr(composer, "AudioAssembler", FakeAssembler)
+    FakeAssembler.episodes = []
+
+    sequential_seconds = compose(tmp_path, concurrency=1)
+    concurrent_seconds = compose(tmp_path, concurrency=8)
+
+    # Several batches, each one a request to the slow backend.
+    assert sequential_seconds >= LATENCY * 4
+    assert concurrent_seconds * 2 < sequential_seconds
+    sequential, concurrent = FakeAssembler.episodes
+    assert concurrent == sequential
+
+
+class RecordingBackend(FakeSpeechBackend):
+    def __init__(self):
+        super().__init__(chars_per_second=1000)
+        self.requests = []
+
+    def speak_ssml(self, ssml):
+        self.requests.append(ssml)
+        return super().speak_ssml(ssml)
+
+
+def test_library_serves_the_date_plug_of_the_day(tmp_path, monkeypatch):
+    monkeypatch.setattr(composer, "AudioAssembler", FakeAssembler)
+    date_created = datetime.datetime(2026, 10, 18)
+    backend = RecordingBackend()
+    tts = TextToSpeech(backend=backend)
+    library = SegmentLibrary("test", str(tmp_path), voice=tts.voice, rate=tts.rate)
+    dates = [date_created.date() + datetime.timedelta(days=idx) for idx in range(3)]
+    library.build(tts, dates)
+    assert library.covers(dates)
+    assert not library.covers([date_created.date() - datetime.timedelta(days=1)])
+
+    backend.requests = []
+    episode = Composer("test", date_created, str(tmp_path), tts=tts, library=library)
+    episode.compose(
+        make_articles(2),
+        output_file=str(tmp_path / "output.mp3"),
+        note_file=str(tmp_path / "notes.txt"),
+    )
+
+    # Only the titles and summaries of the stories are synthesized.
+    assert backend.requests
+    for ssml in backend.requests:
+        assert date_plug_text(date_created) not in ssml
+        assert "Story number" in ssml
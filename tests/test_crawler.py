@@ -0,0 +1,118 @@
+import time
+
+import requests
+
+from crawler.base import BaseCrawler
+from crawler.index import CrawlIndex
+from dedup import Deduplicator
+from dtos import Article
+
+
+class SlowCrawler(BaseCrawler):
+    """Serve fixed candidates, each parse taking its own number of seconds."""
+
+    def __init__(self, delays, urls=None, texts=None, **kwargs):
+        super().__init__(None, **kwargs)
+        self.delays = delays
+        self.urls = urls or [f"https://example.com/{idx}" for idx in range(len(delays))]
+        self.texts = texts or {}
+
+    def get_article_list(self, max_num_articles):
+        for idx, delay in enumerate(self.delays):
+            yield Article(
+                source_name="test",
+                source_id=idx,
+                source_rank=idx,
+                title=f"Story {idx}",
+                url=self.urls[idx],
+            )
+
+    def parse_article(self, article):
+        time.sleep(self.delays[article.source_id])
+        text = self.texts.get(article.source_id, article.title)
+        if text is None:
+            raise IOError("parse failed")
+        article.text_list = [text]
+        return article
+
+
+def test_articles_keep_rank_order():
+    crawler = SlowCrawler([0.2, 0.0, 0.1, 0.0], num_workers=4)
+    articles = crawler.get_articles(3)
+    assert [article.source_id for article in articles] == [0, 1, 2]
+
+
+def test_slow_parses_time_out_and_are_replaced():
+    crawler = SlowCrawler([0.0, 1.0, 0.0], num_workers=2, parse_timeout=0.3)
+    articles = crawler.get_articles(2)
+    assert [article.source_id for article in articles] == [0, 2]
+    assert crawler.failures == {"https://example.com/1": "timed out after 0.3s"}
+
+
+def test_deadline_starts_when_the_parse_starts():
+    # The first two parses time out but keep both threads busy, the third
+    # waits for a thread and still gets its full timeout once it runs.
+    crawler = SlowCrawler([1.0, 1.0, 0.05], num_workers=1, parse_timeout=0.3)
+    articles = crawler.get_articles(1)
+    assert [article.source_id for article in articles] == [2]
+    assert set(crawler.failures) == {
+        "https://example.com/0",
+        "https://example.com/1",
+    }
+
+
+def test_failed_parse_does_not_block_a_later_copy():
+    urls = ["https://example.com/a", "https://www.example.com/a?utm_source=hn"]
+    crawler = SlowCrawler(
+        [0.0, 0.0], urls=urls, texts={0: None}, dedup=Deduplicator()
+    )
+    articles = crawler.get_articles(1)
+    assert [article.source_id for article in articles] == [1]
+
+
+def test_copies_of_a_parsed_article_are_dropped():
+    urls = ["https://example.com/a", "https://m.example.com/a/", "https://b.com"]
+    crawler = SlowCrawler([0.0, 0.0, 0.0], urls=urls, dedup=Deduplicator())
+    articles = crawler.get_articles(2)
+    assert [article.source_id for article in articles] == [0, 2]
+
+
+def test_forgotten_articles_let_a_later_copy_through():
+    urls = ["https://example.com/a", "https://example.com/b", "https://example.com/a"]
+    crawler = SlowCrawler([0.0, 0.0, 0.0], urls=urls, dedup=Deduplicator())
+    articles = crawler.iter_articles(3)
+    first = next(articles)
+    crawler.forget(first)
+    assert [article.source_id for article in articles] == [1, 2]
+
+
+class ValidatingParser:
+    """Serve a page with an ETag, counting the full fetches."""
+
+    def __init__(self):
+        self.fetches = 0
+
+    def get_url_page(self, url):
+        self.fetches += 1
+        return ["Text."], {"etag": '"v1"'}
+
+
+class ConditionalSession(requests.Session):
+    def head(self, url, headers=None, **kwargs):
+        response = requests.Response()
+        response.status_code = 304 if headers.get("If-None-Match") == '"v1"' else 200
+        return response
+
+
+def test_validators_of_the_first_fetch_are_indexed(tmp_path):
+    parser = ValidatingParser()
+    index = CrawlIndex(str(tmp_path / "index.sqlite"), page_ttl=0)
+    crawler = BaseCrawler(parser, index=index, session=ConditionalSession())
+    try:
+        assert crawler._fetch_page("https://example.com/a") == ["Text."]
+        assert index.get_page("https://example.com/a")["etag"] == '"v1"'
+        # The stale page is confirmed unchanged by the server, not fetched again.
+        assert crawler._fetch_page("https://example.com/a") == ["Text."]
+    finally:
+        index.close()
+    assert parser.fetches == 1
@@ -0,0 +1,67 @@
+from extract import extract_text_list
+
+PARAGRAPH = "This is a paragraph of article text that is long enough to count."
+
+
+def page(body, head=""):
+    return f"{head}<html><head><title>t</title></head><body>{body}</body></html>"
+
+
+def test_extracts_the_article_paragraphs():
+    html = page(
+        "<nav>Home | About</nav>"
+        f"<article><h1>Title</h1><p>{PARAGRAPH}</p><p>{PARAGRAPH}</p></article>"
+        "<footer>Copyright</footer>"
+    )
+    assert extract_text_list(html) == ["Title", PARAGRAPH, PARAGRAPH]
+
+
+def test_accepts_an_xml_encoding_declaration():
+    html = page(
+        f"<div><p>{PARAGRAPH}</p></div>",
+        head='<?xml version="1.0" encoding="utf-8"?>',
+    )
+    assert extract_text_list(html) == [PARAGRAPH]
+
+
+def test_keeps_wrappers_with_boilerplate_classes():
+    for wrapper in ["page has-sidebar", "layout-with-header"]:
+        html = page(
+            f'<div class="{wrapper}"><div class="content">'
+            f"<p>{PARAGRAPH}</p><p>{PARAGRAPH}</p>"
+            '<div class="sidebar"><p>Sidebar links that are long enough too.</p></div>'
+            "</div></div>"
+        )
+        assert extract_text_list(html) == [PARAGRAPH, PARAGRAPH], wrapper
+
+
+def test_drops_boilerplate_inside_the_body():
+    html = page(
+        f"<div><p>{PARAGRAPH}</p><p>{PARAGRAPH}</p>"
+        '<div class="related-stories"><p>A related story headline, long enough.</p>'
+        "</div></div>"
+    )
+    assert extract_text_list(html) == [PARAGRAPH, PARAGRAPH]
+
+
+def test_matches_whole_class_tokens_only():
+    html = page(f'<div class="shareholders"><p>{PARAGRAPH}</p></div>')
+    assert extract_text_list(html) == [PARAGRAPH]
+
+
+def test_unparsable_input_gives_no_text():
+    assert extract_text_list("<?xml version='1.0'?>") == []
+
+
+def test_keeps_forms_that_wrap_the_page():
+    paragraphs = f"<p>{PARAGRAPH}</p>" * 10
+    html = page(f'<form id="aspnetForm"><div>{paragraphs}</div></form>')
+    assert extract_text_list(html) == [PARAGRAPH] * 10
+
+
+def test_drops_small_forms():
+    html = page(
+        f"<div><p>{PARAGRAPH}</p><p>{PARAGRAPH}</p>"
+        "<form><p>Get the best stories in your inbox.</p><input></form></div>"
+    )
+    assert extract_text_list(html) == [PARAGRAPH, PARAGRAPH]
@@ -0,0 +1,108 @@
+import re
+import threading
+
+import pytest
+import requests
+
+from benchmarks.fakes import FakeServices
+from crawler.hackernews import HackerNewsCrawler
+from crawler.index import CrawlIndex
+from extract import extract_text_list
+
+
+class CountingSession(requests.Session):
+    """A session that records the path of every GET."""
+
+    def __init__(self):
+        super().__init__()
+        self.paths = []
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        with self._lock:
+            self.paths.append(re.sub(r"^https?://[^/]+", "", url))
+        return super().get(url, **kwargs)
+
+
+class HttpParser:
+    def __init__(self, session):
+        self.session = session
+
+    def get_url_content(self, url):
+        req = self.session.get(url, timeout=10)
+        req.raise_for_status()
+        return extract_text_list(req.text)
+
+
+@pytest.fixture
+def services():
+    with FakeServices(20, latency=0.01, paragraphs_per_article=3) as services:
+        yield services
+
+
+def create_crawler(services, session, **kwargs):
+    return HackerNewsCrawler(
+        HttpParser(session),
+        session=session,
+        topstories_url=services.hn_topstories_url,
+        item_url=services.hn_item_url,
+        **kwargs,
+    )
+
+
+def test_articles_come_in_rank_order(services):
+    session = CountingSession()
+    articles = create_crawler(services, session, num_workers=4).get_articles(8)
+
+    assert [article.source_id for article in articles] == list(range(1, 9))
+    assert [article.source_rank for article in articles] == list(range(8))
+    for article in articles:
+        assert article.title == f"Story number {article.source_id}"
+        assert article.text_list
+    # Items are only requested a window ahead of the stories still needed.
+    items = [path for path in session.paths if path.startswith("/v0/item/")]
+    assert len(items) <= 8 + 8
+
+
+def test_failed_articles_are_replaced_in_rank_order():
+    with FakeServices(30, error_rate=0.3, paragraphs_per_article=3) as services:
+        session = CountingSession()
+        crawler = create_crawler(services, session, num_workers=4)
+        articles = crawler.get_articles(5)
+
+    ranks = [article.source_rank for article in articles]
+    assert len(articles) == 5
+    assert ranks == sorted(ranks)
+    for article in articles:
+        assert article.url not in crawler.failures
+
+
+def test_index_serves_items_and_pages_of_a_recent_crawl(services, tmp_path):
+    index = CrawlIndex(str(tmp_path / "index.sqlite"))
+    try:
+        first = create_crawler(services, CountingSession(), index=index)
+        expected = first.get_articles(5)
+
+        session = CountingSession()
+        articles = create_crawler(services, session, index=index).get_articles(5)
+    finally:
+        index.close()
+
+    assert [article.url for article in articles] == [a.url for a in expected]
+    assert [a.text_list for a in articles] == [a.text_list for a in expected]
+    # Only the top stories list is requested again.
+    assert session.paths == ["/v0/topstories.json"]
+
+
+def test_stale_pages_are_fetched_once(services, tmp_path):
+    index = CrawlIndex(str(tmp_path / "index.sqlite"), page_ttl=0)
+    try:
+        create_crawler(services, CountingSession(), index=index).get_articles(5)
+
+        session = CountingSession()
+        articles = create_crawler(services, session, index=index).get_articles(5)
+    finally:
+        index.close()
+
+    pages = [path for path in session.paths if path.startswith("/articles/")]
+    assert sorted(pages) == sorted(f"/articles/{a.source_id}" for a in articles)
@@ -0,0 +1,29 @@
+import time
+
+from crawler.index import CrawlIndex
+
+
+def test_prune_deletes_old_items_and_pages(tmp_path):
+    path = str(tmp_path / "index.sqlite")
+    index = CrawlIndex(path)
+    try:
+        index.put_item("test", 1, "Old story", "https://example.com/old", skip=True)
+        index.put_page("https://example.com/old", ["Old text."])
+        time.sleep(0.1)
+        index.put_item("test", 2, "New story", "https://example.com/new", skip=False)
+        index.put_page("https://example.com/new", ["New text."])
+
+        index.max_age = 0.05
+        assert index.prune() == 2
+    finally:
+        index.close()
+
+    # Skipped items never expire on their own, only the prune removes them.
+    index = CrawlIndex(path)
+    try:
+        assert index.get_item("test", 1) is None
+        assert index.get_page("https://example.com/old") is None
+        assert index.get_item("test", 2)["title"] == "New story"
+        assert index.get_page("https://example.com/new")["text_list"] == ["New text."]
+    finally:
+        index.close()
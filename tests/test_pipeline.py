@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+# The summary module imports openai, which has to be installed to import it.
+pytest.importorskip("openai")
+
+from crawler.base import BaseCrawler  # noqa: E402
+from dtos import Article  # noqa: E402
+from pipeline import Pipeline  # noqa: E402
+from summary import OpenAISummarizer  # noqa: E402
+
+
+class FakeCrawler(BaseCrawler):
+    """Serve `num_stories` candidates, recording the ones parsed and forgotten."""
+
+    def __init__(self, num_stories, **kwargs):
+        super().__init__(None, **kwargs)
+        self.num_stories = num_stories
+        self.parsed = []
+        self.forgotten = []
+        self._lock = threading.Lock()
+
+    def get_article_list(self, max_num_articles):
+        for idx in range(self.num_stories):
+            yield Article(
+                source_name="test",
+                source_id=idx,
+                source_rank=idx,
+                title=f"Story {idx}",
+                url=f"https://example.com/{idx}",
+            )
+
+    def parse_article(self, article):
+        time.sleep(0.01)
+        with self._lock:
+            self.parsed.append(article.source_id)
+        article.text_list = [f"Text of story {article.source_id}."]
+        return article
+
+    def forget(self, article):
+        self.forgotten.append(article.source_id)
+
+
+class FakeSummarizer(OpenAISummarizer):
+    """Summarize without OpenAI, the stories in `failures` fail."""
+
+    def __init__(self, failures=(), delays=None):
+        super().__init__(max_concurrency=2)
+        self.failures = set(failures)
+        self.delays = delays or {}
+        self.summarized = []
+        self._lock = threading.Lock()
+
+    def summarize(self, text_list):
+        source_id = int(text_list[0].split()[-1].rstrip("."))
+        time.sleep(self.delays.get(source_id, 0.01))
+        with self._lock:
+            self.summarized.append(source_id)
+        if source_id in self.failures:
+            return None
+        return f"Summary of story {source_id}."
+
+
+class FakeComposer:
+    concurrency = 2
+
+    def __init__(self):
+        self.prepared = []
+        self.composed = None
+
+    def prepare_story(self, story):
+        self.prepared.append(story.source_id)
+
+    def compose(self, article_list, output_file, note_file):
+        self.composed = article_list
+
+
+def articles(num_stories):
+    return FakeCrawler(num_stories).get_articles(num_stories)
+
+
+def test_pipeline_matches_the_sequential_commands():
+    sequential = FakeSummarizer(failures={1, 4}).summarize_articles(
+        FakeCrawler(20, num_workers=3).get_articles(10), 5
+    )
+
+    crawler = FakeCrawler(20, num_workers=3)
+    composer = FakeComposer()
+    with FakeSummarizer(failures={1, 4}) as summarizer:
+        pipeline = Pipeline(crawler, summarizer, composer, summary_workers=3)
+        pipelined = pipeline.run(10, 5)
+
+    expected = [0, 2, 3, 5, 6]
+    assert [a.source_id for a in sequential] == expected
+    assert [a.source_id for a in pipelined] == expected
+    assert [a.summary for a in pipelined] == [a.summary for a in sequential]
+    assert composer.composed == pipelined
+    assert sorted(composer.prepared) == expected
+
+
+def test_failed_summaries_are_replaced_and_forgotten():
+    crawler = FakeCrawler(10)
+    with FakeSummarizer(failures={0, 2}) as summarizer:
+        article_list = Pipeline(crawler, summarizer, FakeComposer()).run(10, 3)
+
+    assert [a.source_id for a in article_list] == [1, 3, 4]
+    assert sorted(crawler.forgotten) == [0, 2]
+
+
+def test_max_summaries_stops_the_crawl():
+    crawler = FakeCrawler(200, num_workers=2)
+    with FakeSummarizer() as summarizer:
+        pipeline = Pipeline(
+            crawler, summarizer, FakeComposer(), queue_size=2, summary_workers=2
+        )
+        article_list = pipeline.run(200, 3)
+
+    assert len(article_list) == 3
+    # A few articles are in the queue or in progress when the last summary
+    # is done, the rest of the stories are never crawled or summarized.
+    assert len(crawler.parsed) < 20
+    assert len(summarizer.summarized) < 10
+
+
+def test_iter_summaries_yields_in_rank_order():
+    with FakeSummarizer(failures={2}, delays={0: 0.2}) as summarizer:
+        summaries = summarizer.iter_summaries(articles(10), 4, max_workers=3)
+        assert [a.source_id for a in summaries] == [0, 1, 3, 4]
+
+
+def test_iter_summaries_yields_before_later_ranks_are_done():
+    with FakeSummarizer(delays={1: 0.5, 2: 0.5}) as summarizer:
+        start = time.perf_counter()
+        summaries = summarizer.iter_summaries(articles(3), 3, max_workers=3)
+        assert next(summaries).source_id == 0
+        assert time.perf_counter() - start < 0.3
+        summaries.close()
+
+
+def test_iter_summaries_submits_no_more_than_needed():
+    with FakeSummarizer() as summarizer:
+        list(summarizer.iter_summaries(articles(10), 3, max_workers=4))
+    assert sorted(summarizer.summarized) == [0, 1, 2]
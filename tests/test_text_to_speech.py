@@ -0,0 +1,72 @@
+import io
+import time
+import wave
+
+from cache import FileCache
+from text_to_speech import FakeSpeechBackend, TextToSpeech
+
+LATENCY = 0.05
+TEXTS = [f"Story number {idx}. This is a summary of the story." for idx in range(8)]
+
+
+def num_frames(audio_data):
+    with wave.open(io.BytesIO(audio_data), "rb") as wav:
+        return wav.getnframes()
+
+
+def test_batching_is_faster_than_one_request_per_text():
+    tts = TextToSpeech(backend=FakeSpeechBackend(latency=LATENCY))
+
+    start = time.perf_counter()
+    sequential = [tts.synthesize(text) for text in TEXTS]
+    sequential_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = tts.synthesize_batch(TEXTS)
+    batched_seconds = time.perf_counter() - start
+
+    assert sequential_seconds >= LATENCY * len(TEXTS)
+    assert batched_seconds * 4 < sequential_seconds
+    # Splitting at the bookmarks gives each text about as much audio as its own.
+    for single, split in zip(sequential, batched):
+        assert abs(num_frames(single) - num_frames(split)) <= 1
+
+
+class CountingBackend(FakeSpeechBackend):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requests = 0
+
+    def speak_ssml(self, ssml):
+        self.requests += 1
+        return super().speak_ssml(ssml)
+
+
+def test_single_requests_do_not_reuse_clips_split_from_a_batch(tmp_path):
+    backend = CountingBackend()
+    tts = TextToSpeech(cache=FileCache(str(tmp_path), 10**8), backend=backend)
+
+    tts.synthesize_batch(TEXTS)
+    assert backend.requests == 1
+    tts.synthesize_batch(TEXTS)
+    assert backend.requests == 1
+
+    tts.synthesize(TEXTS[0])
+    assert backend.requests == 2
+    tts.synthesize(TEXTS[0])
+    assert backend.requests == 2
+
+
+def test_failed_requests_give_no_audio():
+    tts = TextToSpeech(backend=FakeSpeechBackend(error_rate=1.0))
+    assert tts.synthesize_batch(TEXTS) == [None] * len(TEXTS)
+
+
+
+def test_failed_batch_is_retried_one_text_per_request():
+    # With this seed the batch request fails and the single requests do not.
+    backend = CountingBackend(error_rate=0.3, seed=72)
+    audio_list = TextToSpeech(backend=backend).synthesize_batch(TEXTS)
+
+    assert backend.requests == 1 + len(TEXTS)
+    assert None not in audio_list
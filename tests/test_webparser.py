@@ -0,0 +1,271 @@
+import asyncio
+import threading
+
+import pytest
+import requests
+
+# The module imports playwright, which has to be installed to import it.
+pytest.importorskip("playwright")
+
+import webparser  # noqa: E402
+from crawler.base import PARSE_NUM_WORKERS  # noqa: E402
+from webparser import BrowserPool, ChromeExtensionBypassPaywallParser  # noqa: E402
+
+
+class BrokenPlaywright:
+    async def start(self):
+        raise RuntimeError("no browser here")
+
+
+def test_close_after_a_failed_start(monkeypatch):
+    monkeypatch.setattr(webparser, "async_playwright", BrokenPlaywright)
+    pool = BrowserPool()
+    with pytest.raises(RuntimeError):
+        pool.start()
+    pool.close()
+    assert pool._loop is None
+
+
+def test_browser_parser_opens_a_page_per_worker():
+    parser = ChromeExtensionBypassPaywallParser()
+    assert parser.pool.num_pages == PARSE_NUM_WORKERS
+
+
+class FakePage:
+    def __init__(self, context):
+        self.context = context
+        self.handlers = {}
+        self.closed = False
+        self.url = None
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+    async def goto(self, url):
+        self.url = url
+        if url.endswith("/slow"):
+            await asyncio.sleep(10)
+        elif url.endswith("/crash"):
+            self.handlers["crash"](self)
+        elif url.endswith("/context-crash"):
+            self.context.crash()
+
+    async def content(self):
+        return f"<html>{self.url}</html>"
+
+    def is_closed(self):
+        return self.closed
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeContext:
+    def __init__(self, playwright):
+        self.playwright = playwright
+        self.handlers = {}
+        self.pages = []
+        self.closed = False
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+    def remove_listener(self, event, handler):
+        self.handlers.pop(event, None)
+
+    async def new_page(self):
+        page = FakePage(self)
+        self.pages.append(page)
+        return page
+
+    def crash(self):
+        if "close" in self.handlers:
+            self.handlers["close"](self)
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeBrowser:
+    def __init__(self, playwright):
+        self.playwright = playwright
+        self.closed = False
+
+    def is_connected(self):
+        return not self.closed
+
+    async def new_context(self):
+        return self.playwright.new_context()
+
+    async def close(self):
+        self.closed = True
+
+
+class FakePlaywright:
+    """Stand in for async_playwright, counting the browsers and contexts."""
+
+    def __init__(self):
+        self.chromium = self
+        self.browsers = []
+        self.contexts = []
+        self.stopped = False
+
+    def __call__(self):
+        return self
+
+    async def start(self):
+        self.stopped = False
+        return self
+
+    async def stop(self):
+        self.stopped = True
+
+    async def launch(self, headless=True, args=None):
+        self.browsers.append(FakeBrowser(self))
+        return self.browsers[-1]
+
+    async def launch_persistent_context(self, user_data_dir, headless=True, args=None):
+        return self.new_context()
+
+    def new_context(self):
+        self.contexts.append(FakeContext(self))
+        return self.contexts[-1]
+
+
+@pytest.fixture
+def playwright(monkeypatch):
+    fake = FakePlaywright()
+    monkeypatch.setattr(webparser, "async_playwright", fake)
+    return fake
+
+
+def test_threads_share_one_browser_and_context(playwright):
+    urls = [f"https://example.com/{idx}" for idx in range(20)]
+    results = {}
+
+    def load(url):
+        results[url] = pool.get_content(url)
+
+    with BrowserPool(num_pages=4, max_navigations=100) as pool:
+        threads = [threading.Thread(target=load, args=(url,)) for url in urls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert results == {url: f"<html>{url}</html>" for url in urls}
+    assert len(playwright.browsers) == 1
+    assert len(playwright.contexts) == 1
+    pages = playwright.contexts[0].pages
+    assert len(pages) == len(urls)
+    assert all(page.closed for page in pages)
+
+
+def test_context_is_recycled_after_max_navigations(playwright):
+    with BrowserPool(max_navigations=3) as pool:
+        for idx in range(7):
+            pool.get_content(f"https://example.com/{idx}")
+        assert [context.closed for context in playwright.contexts] == [
+            True,
+            True,
+            False,
+        ]
+    assert [len(context.pages) for context in playwright.contexts] == [3, 3, 1]
+    assert len(playwright.browsers) == 1
+
+
+@pytest.mark.parametrize("crash", ["crash", "context-crash"])
+def test_context_is_recycled_after_a_crash(playwright, crash):
+    with BrowserPool(max_navigations=100) as pool:
+        pool.get_content("https://example.com/1")
+        pool.get_content(f"https://example.com/{crash}")
+        assert playwright.contexts[0].closed
+        pool.get_content("https://example.com/2")
+    assert [len(context.pages) for context in playwright.contexts] == [2, 1]
+
+
+def test_persistent_context_is_recycled(playwright, tmp_path):
+    with BrowserPool(max_navigations=2, user_data_dir=str(tmp_path)) as pool:
+        for idx in range(4):
+            pool.get_content(f"https://example.com/{idx}")
+    assert len(playwright.contexts) == 2
+    assert not playwright.browsers
+
+
+def test_slow_page_is_cancelled_and_frees_its_tab(playwright):
+    with BrowserPool(num_pages=1, page_timeout=0.1) as pool:
+        with pytest.raises(asyncio.TimeoutError):
+            pool.get_content("https://example.com/slow")
+        assert playwright.contexts[0].pages[0].closed
+        assert pool.get_content("https://example.com/1") == (
+            "<html>https://example.com/1</html>"
+        )
+
+
+def test_lifecycle(playwright):
+    pool = BrowserPool()
+    # Starts on the first page load.
+    pool.get_content("https://example.com/1")
+    pool.close()
+    assert playwright.stopped
+    assert playwright.contexts[0].closed
+    assert playwright.browsers[0].closed
+    assert pool._loop is None and pool._thread is None
+    # Closing twice is harmless, and a closed pool starts again when used.
+    pool.close()
+    pool.get_content("https://example.com/2")
+    pool.close()
+    assert len(playwright.browsers) == 2
+    assert all(context.closed for context in playwright.contexts)
+
+
+class StaticParser(webparser.SimpleParser):
+    def __init__(self, html, extract_mode="auto"):
+        super().__init__(extract_mode=extract_mode)
+        self.html = html
+
+    def get_response(self, url):
+        req = requests.Response()
+        req.status_code = 200
+        req.encoding = "utf-8"
+        req._content = self.html.encode()
+        return req
+
+
+class BrowserStub(webparser.BaseParser):
+    def __init__(self):
+        super().__init__()
+        self.urls = []
+
+    def get_url_content(self, url):
+        self.urls.append(url)
+        return ["From the browser."]
+
+
+def no_readability(html):
+    raise AssertionError("readability ran on a page sent to the browser")
+
+
+def test_escalation_is_decided_on_the_fast_extraction(tmp_path, monkeypatch):
+    monkeypatch.setattr(webparser, "readability_text_list", no_readability)
+    browser = BrowserStub()
+    parser = webparser.TieredParser(
+        StaticParser("<html><body><p>Subscribe to read.</p></body></html>"),
+        browser,
+        rules_path=str(tmp_path / "rules.json"),
+    )
+
+    assert parser.get_url_content("https://example.com/a") == ["From the browser."]
+    assert browser.urls == ["https://example.com/a"]
+
+
+def test_readability_runs_on_pages_kept_from_plain_http(tmp_path, monkeypatch):
+    monkeypatch.setattr(webparser, "readability_text_list", lambda html: ["Clean."])
+    paragraph = "<p>" + "A long paragraph of the article. " * 20 + "</p>"
+    parser = webparser.TieredParser(
+        StaticParser(f"<html><body>{paragraph * 3}</body></html>", "readability"),
+        BrowserStub(),
+        rules_path=str(tmp_path / "rules.json"),
+    )
+
+    assert parser.get_url_content("https://example.com/a") == ["Clean."]
@@ -1,57 +1,298 @@
+import io
+import logging
 import os
+import random
+import re
 import sys
-import azure.cognitiveservices.speech as speechsdk
+import threading
+import time
+import wave
+from typing import List, Tuple, Union
+from xml.sax.saxutils import escape
 
+from cache import FileCache, hash_key
+from metrics import METRICS
 
-class TextToSpeech:
-    def __init__(self):
-        # This example requires environment variables named "SPEECH_KEY" and "SPEECH_REGION"
-        self.speech_config = speechsdk.SpeechConfig(
-            subscription=os.environ.get("AZURE_KEY"),
-            region=os.environ.get("AZURE_REGION"),
-        )
-
-        # The language of the voice that speaks.
-        self.speech_config.speech_synthesis_voice_name = "en-US-JennyNeural"
+TTS_VOICE = "en-US-JennyNeural"
+TTS_RATE = "+30%"
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", ".cache/tts")
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", 1024**3))
+# Keep batched requests well under the service's per-request audio limit.
+TTS_BATCH_MAX_CHARS = 3000
+BATCH_CACHE_NAMESPACE = "batch"
 
-    def convert(self, text: str, output_file: str):
-        ssml = """
+SSML_TEMPLATE = """
         <speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis"
             xmlns:mstts="https://www.w3.org/2001/mstts" xml:lang="zh-CN">
-            <voice name="en-US-JennyNeural">
-                <prosody rate="+30%">
+            <voice name="{voice}">
+                <prosody rate="{rate}">
                     {text}
                 </prosody>
             </voice>
         </speak>
-        """.format(
-            text=text
-        )
+        """
+BOOKMARK_TEMPLATE = '<bookmark mark="{}"/>'
+
+
+class SpeechSynthesisError(Exception):
+    pass
+
+
+class SpeechBackend:
+    def speak_ssml(self, ssml: str) -> Tuple[bytes, List[float]]:
+        """Synthesize SSML, return the WAV bytes and the bookmark offsets in seconds."""
+        raise NotImplementedError()
+
 
-        audio_config = speechsdk.audio.AudioOutputConfig(filename=output_file)
-        speech_synthesizer = speechsdk.SpeechSynthesizer(
-            speech_config=self.speech_config, audio_config=audio_config
+class AzureSpeechBackend(SpeechBackend):
+    def __init__(self, voice: str = TTS_VOICE):
+        # The SDK is only needed here, the fake backend runs without it.
+        import azure.cognitiveservices.speech as speechsdk
+
+        self._sdk = speechsdk
+        # This example requires environment variables named "SPEECH_KEY" and "SPEECH_REGION"
+        self.speech_config = self._sdk.SpeechConfig(
+            subscription=os.environ.get("AZURE_KEY"),
+            region=os.environ.get("AZURE_REGION"),
         )
+
+        # The language of the voice that speaks.
+        self.speech_config.speech_synthesis_voice_name = voice
+
+        # One long-lived synthesizer per thread, each keeps its connection open.
+        self._local = threading.local()
+
+    def speak_ssml(self, ssml: str) -> Tuple[bytes, List[float]]:
+        speech_synthesizer, bookmarks = self._get_synthesizer()
+        bookmarks.clear()
         speech_synthesis_result = speech_synthesizer.speak_ssml(ssml)
 
         if (
             speech_synthesis_result.reason
-            == speechsdk.ResultReason.SynthesizingAudioCompleted
+            == self._sdk.ResultReason.SynthesizingAudioCompleted
         ):
-            print("Speech synthesized for text [{}]".format(text))
-        elif speech_synthesis_result.reason == speechsdk.ResultReason.Canceled:
+            return speech_synthesis_result.audio_data, list(bookmarks)
+        elif speech_synthesis_result.reason == self._sdk.ResultReason.Canceled:
             cancellation_details = speech_synthesis_result.cancellation_details
             print("Speech synthesis canceled: {}".format(cancellation_details.reason))
-            if cancellation_details.reason == speechsdk.CancellationReason.Error:
+            if cancellation_details.reason == self._sdk.CancellationReason.Error:
                 if cancellation_details.error_details:
                     print(
                         "Error details: {}".format(cancellation_details.error_details)
                     )
                     print("Did you set the speech resource key and region values?")
+        raise SpeechSynthesisError(
+            "Speech synthesis failed: {}".format(speech_synthesis_result.reason)
+        )
+
+    def _get_synthesizer(self):
+        if not hasattr(self._local, "synthesizer"):
+            # Without an audio config the result keeps the audio in memory.
+            synthesizer = self._sdk.SpeechSynthesizer(
+                speech_config=self.speech_config, audio_config=None
+            )
+            bookmarks = []
+            # Offsets are reported in ticks of 100 nanoseconds.
+            synthesizer.bookmark_reached.connect(
+                lambda evt: bookmarks.append(evt.audio_offset / 10**7)
+            )
+            self._local.synthesizer = synthesizer
+            self._local.bookmarks = bookmarks
+        return self._local.synthesizer, self._local.bookmarks
+
+
+class FakeSpeechBackend(SpeechBackend):
+    """Emit silent WAVs of a realistic length, for testing and benchmarking offline.
+
+    Each request fails with probability `error_rate`, like a cancelled synthesis.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        chars_per_second: float = 15.0,
+        frame_rate: int = 16000,
+        error_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.chars_per_second = chars_per_second
+        self.frame_rate = frame_rate
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def speak_ssml(self, ssml: str) -> Tuple[bytes, List[float]]:
+        time.sleep(self.latency)
+        with self._lock:
+            failed = self._rng.random() < self.error_rate
+        if failed:
+            raise SpeechSynthesisError("Fake synthesis failure")
+        body = re.search(r"<prosody[^>]*>(.*)</prosody>", ssml, re.S).group(1)
+        offsets = []
+        duration = 0.0
+        for idx, part in enumerate(re.split(r"<bookmark[^>]*/>", body)):
+            if idx > 0:
+                offsets.append(duration)
+            duration += len(re.sub(r"<[^>]+>", "", part).strip()) / self.chars_per_second
+        num_frames = int(duration * self.frame_rate)
+        return to_wav(b"\0\0" * num_frames, self.frame_rate, 1, 2), offsets
+
+
+class TextToSpeech:
+    def __init__(
+        self,
+        voice: str = TTS_VOICE,
+        rate: str = TTS_RATE,
+        cache: FileCache = None,
+        backend: SpeechBackend = None,
+    ):
+        self.voice = voice
+        self.rate = rate
+        self.cache = cache
+        self.backend = backend or AzureSpeechBackend(voice)
+
+    def build_ssml(self, text: str) -> str:
+        return SSML_TEMPLATE.format(voice=self.voice, rate=self.rate, text=escape(text))
+
+    def synthesize(self, text: str) -> Union[bytes, None]:
+        """Synthesize text and return the WAV bytes, or None on failure."""
+        return self.synthesize_batch([text])[0]
+
+    @METRICS.timed("TextToSpeech.synthesize_batch")
+    def synthesize_batch(self, texts: List[str]) -> List[Union[bytes, None]]:
+        """Synthesize several texts in one SSML request, return the WAV bytes of each.
+
+        The texts are separated by bookmarks and the audio is split back at
+        the bookmark offsets. Cached texts are not sent. If the batch fails,
+        the texts are retried one request each.
+        """
+        results = [None] * len(texts)
+        cache_keys = [hash_key(self.voice, self.rate, self.build_ssml(t)) for t in texts]
+        # Clips split from a batch may cut words short, they are kept apart so
+        # that single requests never get them.
+        batch_keys = [hash_key(BATCH_CACHE_NAMESPACE, key) for key in cache_keys]
+        missing = []
+        for idx, cache_key in enumerate(cache_keys):
+            if self.cache is not None:
+                results[idx] = self.cache.get_bytes(cache_key)
+                if results[idx] is None and len(texts) > 1:
+                    results[idx] = self.cache.get_bytes(batch_keys[idx])
+            if results[idx] is not None:
+                logging.debug("Speech loaded from cache for text [%s]", texts[idx])
+                METRICS.incr("tts_cache_hits")
+            else:
+                missing.append(idx)
+                METRICS.incr("tts_cache_misses")
+        if not missing:
+            return results
+
+        audio_list = None
+        if len(missing) > 1:
+            audio_list = self._speak_batch([texts[idx] for idx in missing])
+        if audio_list is None:
+            audio_list = [self._speak(texts[idx]) for idx in missing]
+            keys = cache_keys
+        else:
+            keys = batch_keys
+
+        for idx, audio_data in zip(missing, audio_list):
+            results[idx] = audio_data
+            if audio_data is not None:
+                logging.debug("Speech synthesized for text [%s]", texts[idx])
+                if self.cache is not None:
+                    self.cache.put(keys[idx], audio_data)
+        return results
+
+    @METRICS.timed("TextToSpeech.convert")
+    def convert(self, text: str, output_file: str) -> bool:
+        audio_data = self.synthesize(text)
+        if audio_data is None:
+            return False
+        with open(output_file, "wb") as f:
+            f.write(audio_data)
+        return True
+
+    def _speak(self, text: str) -> Union[bytes, None]:
+        METRICS.incr("tts_requests")
+        METRICS.incr("tts_characters", len(text))
+        try:
+            audio_data, _ = self.backend.speak_ssml(self.build_ssml(text))
+        except SpeechSynthesisError:
+            return None
+        return audio_data
+
+    def _speak_batch(self, texts: List[str]) -> Union[List[bytes], None]:
+        body = " ".join(
+            BOOKMARK_TEMPLATE.format(idx) + escape(text) for idx, text in enumerate(texts)
+        )
+        ssml = SSML_TEMPLATE.format(voice=self.voice, rate=self.rate, text=body)
+        METRICS.incr("tts_requests")
+        METRICS.incr("tts_characters", sum(len(text) for text in texts))
+        try:
+            audio_data, offsets = self.backend.speak_ssml(ssml)
+        except SpeechSynthesisError:
+            return None
+        if len(offsets) != len(texts):
+            logging.warning(
+                "Expected %d bookmarks, got %d, retrying one text per request",
+                len(texts),
+                len(offsets),
+            )
+            return None
+        # The first segment also takes the leading silence.
+        return split_wav(audio_data, [0.0] + offsets[1:])
+
+
+def split_batches(texts: List[str], max_chars: int = TTS_BATCH_MAX_CHARS):
+    """Group texts, in order, into batches of at most `max_chars` characters."""
+    batches = []
+    batch = []
+    num_chars = 0
+    for text in texts:
+        if batch and num_chars + len(text) > max_chars:
+            batches.append(batch)
+            batch = []
+            num_chars = 0
+        batch.append(text)
+        num_chars += len(text)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def to_wav(frames: bytes, frame_rate: int, channels: int, sample_width: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setframerate(frame_rate)
+        wav.setnchannels(channels)
+        wav.setsampwidth(sample_width)
+        wav.writeframes(frames)
+    return buffer.getvalue()
+
+
+def split_wav(audio_data: bytes, offsets: List[float]) -> List[bytes]:
+    """Split WAV bytes into one WAV per segment, starting at the offsets in seconds."""
+    with wave.open(io.BytesIO(audio_data), "rb") as wav:
+        params = (wav.getframerate(), wav.getnchannels(), wav.getsampwidth())
+        frames = wav.readframes(wav.getnframes())
+    frame_rate, channels, sample_width = params
+    frame_size = channels * sample_width
+    bounds = [int(offset * frame_rate) * frame_size for offset in offsets]
+    bounds.append(len(frames))
+    return [
+        to_wav(frames[start:end], *params) for start, end in zip(bounds, bounds[1:])
+    ]
+
+
+def create_cache(
+    cache_dir: str = TTS_CACHE_DIR, max_bytes: int = TTS_CACHE_MAX_BYTES
+) -> FileCache:
+    return FileCache(cache_dir, max_bytes)
 
 
 if __name__ == "__main__":
-    client = TextToSpeech()
+    client = TextToSpeech(cache=create_cache())
 
     text = sys.argv[1]
     output_path = sys.argv[2]
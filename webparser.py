@@ -1,51 +1,441 @@
+import asyncio
 import logging
-from typing import List
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+from typing import Dict, List, Tuple
 import requests
 
-from playwright.sync_api import sync_playwright
-from readabilipy import simple_json_from_html_string
+from playwright.async_api import async_playwright
+
+from crawler.base import PARSE_NUM_WORKERS
+from extract import extract_text_list, readability_text_list
+from metrics import METRICS
+
+BROWSER_NUM_PAGES = 4
+BROWSER_MAX_NAVIGATIONS = 100
+# "fast" uses the lxml extractor, "readability" the Node.js readability step,
+# "auto" the fast path with readability as a fallback for short results.
+EXTRACT_MODE = os.environ.get("EXTRACT_MODE", "auto")
+EXTRACT_MIN_CHARS = 500
+HTTP_TIMEOUT = 30
+PARSER_RULES_PATH = os.environ.get("PARSER_RULES_PATH", ".cache/parser_rules.json")
+# A domain goes straight to the browser after this many escalations in a row.
+PARSER_RULES_MIN_ESCALATIONS = 2
+# After this many seconds a browser-only domain is tried with plain HTTP again.
+PARSER_RULES_TTL = int(os.environ.get("PARSER_RULES_TTL", 7 * 24 * 3600))
+# Longer texts are real articles even when they mention a paywall.
+BLOCKED_CHECK_MAX_CHARS = 3000
+BLOCKED_PATTERN = re.compile(
+    r"paywall|subscribe to (continue|read)|subscription required|"
+    r"(enable|turn on) javascript|javascript is (disabled|required)|"
+    r"are you a robot|verify you are human",
+    re.I,
+)
+
+
+class BrowserPool:
+    """A long-lived Chromium instance that serves pages to many threads.
+
+    Playwright runs on a dedicated event loop thread, so `get_content` can be
+    called concurrently from any thread. Up to `num_pages` tabs are open at a
+    time. The browser context is recycled after `max_navigations` page loads,
+    or as soon as a page or the context crashes. A page load that takes longer
+    than `page_timeout` seconds is cancelled and its tab closed.
+    """
+
+    def __init__(
+        self,
+        num_pages: int = BROWSER_NUM_PAGES,
+        max_navigations: int = BROWSER_MAX_NAVIGATIONS,
+        headless: bool = True,
+        user_data_dir: str = None,
+        args: List[str] = None,
+        page_timeout: float = None,
+    ):
+        self.num_pages = num_pages
+        self.max_navigations = max_navigations
+        self.headless = headless
+        self.user_data_dir = user_data_dir
+        self.args = args or []
+        self.page_timeout = page_timeout
+
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._playwright = None
+        self._browser = None
+        self._context = None
+        self._crashed = False
+        self._retiring = False
+        self._active = 0
+        self._navigations = 0
+
+    def start(self):
+        with self._lock:
+            if self._loop is not None:
+                return self
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._loop.run_forever, daemon=True
+            )
+            self._thread.start()
+            try:
+                self._run(self._start())
+            except BaseException:
+                # Leave the pool as if never started, so that it can be retried.
+                self._stop_loop()
+                raise
+        return self
+
+    def close(self):
+        with self._lock:
+            if self._loop is None:
+                return
+            try:
+                self._run(self._stop())
+            finally:
+                self._stop_loop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_content(self, url: str) -> str:
+        """Load a URL in one of the pool's tabs and return the page HTML."""
+        self.start()
+        return self._run(self._get_content(url))
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _start(self):
+        self._playwright = await async_playwright().start()
+        self._pages = asyncio.Semaphore(self.num_pages)
+        self._cond = asyncio.Condition()
+
+    def _stop_loop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+        self._thread = None
+
+    async def _stop(self):
+        await self._close_context()
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def _launch_context(self):
+        logging.info("Launching browser context")
+        if self.user_data_dir:
+            context = await self._playwright.chromium.launch_persistent_context(
+                self.user_data_dir, headless=self.headless, args=self.args
+            )
+        else:
+            if self._browser is None or not self._browser.is_connected():
+                self._browser = await self._playwright.chromium.launch(
+                    headless=self.headless, args=self.args
+                )
+            context = await self._browser.new_context()
+        context.on("close", self._on_crash)
+        self._crashed = False
+        self._navigations = 0
+        return context
+
+    async def _close_context(self):
+        context, self._context = self._context, None
+        if context is None:
+            return
+        context.remove_listener("close", self._on_crash)
+        try:
+            await context.close()
+        except Exception:
+            logging.warning("Failed to close browser context cleanly")
+
+    def _on_crash(self, *args):
+        logging.warning("Browser page or context crashed, recycling")
+        self._crashed = True
+
+    async def _acquire_context(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._retiring)
+            if self._context is None:
+                self._context = await self._launch_context()
+            self._active += 1
+            return self._context
+
+    async def _release_context(self, context):
+        async with self._cond:
+            self._active -= 1
+            if context is self._context:
+                self._navigations += 1
+                if self._crashed or self._navigations >= self.max_navigations:
+                    self._retiring = True
+            if self._retiring and self._active == 0:
+                # Persistent contexts lock their profile directory, so the old
+                # context has to be gone before a new one is launched.
+                await self._close_context()
+                self._retiring = False
+                self._cond.notify_all()
+
+    async def _get_content(self, url: str) -> str:
+        async with self._pages:
+            context = await self._acquire_context()
+            try:
+                page = await context.new_page()
+                page.on("crash", self._on_crash)
+                try:
+                    # Only the page load is timed, not the wait for a free tab.
+                    return await asyncio.wait_for(
+                        self._load(page, url), self.page_timeout
+                    )
+                finally:
+                    if not page.is_closed():
+                        await page.close()
+            finally:
+                await self._release_context(context)
+
+    async def _load(self, page, url: str) -> str:
+        await page.goto(url)
+        return await page.content()
 
 
 class BaseParser:
+    def __init__(self, extract_mode: str = EXTRACT_MODE):
+        if extract_mode not in ("fast", "readability", "auto"):
+            raise ValueError(f"Unknown extract mode: {extract_mode}")
+        self.extract_mode = extract_mode
+
     def get_url_content(self, url) -> List[str]:
         """Get the content of a URL, return as a list of strings."""
         raise NotImplementedError()
 
+    def get_url_page(self, url) -> Tuple[List[str], Dict[str, str]]:
+        """Get the content of a URL and the validators of its response.
+
+        The validators are its "etag" and "last_modified" headers, when known.
+        """
+        return self.get_url_content(url), {}
+
+    def extract(self, html: str, text_list: List[str] = None) -> List[str]:
+        """Extract the article text of a page, return as a list of strings.
+
+        `text_list` is the fast extraction of the page, if it was already done.
+        """
+        if self.extract_mode == "readability":
+            return readability_text_list(html)
+        if text_list is None:
+            text_list = extract_text_list(html)
+        if self.extract_mode == "auto":
+            num_chars = sum(len(text) for text in text_list)
+            if num_chars < EXTRACT_MIN_CHARS:
+                logging.info(
+                    "Fast extraction got %d characters, using readability", num_chars
+                )
+                return readability_text_list(html)
+        return text_list
+
 
 class SimpleParser(BaseParser):
+    def __init__(
+        self,
+        session: requests.Session = None,
+        timeout: float = HTTP_TIMEOUT,
+        extract_mode: str = EXTRACT_MODE,
+    ):
+        super().__init__(extract_mode)
+        self.session = session or requests.Session()
+        self.timeout = timeout
+
     def get_url_content(self, url) -> List[str]:
         """Get the content of a URL, return as a list of strings."""
+        return self.extract(self.get_html(url))
+
+    def get_url_page(self, url) -> Tuple[List[str], Dict[str, str]]:
+        req = self.get_response(url)
+        return self.extract(req.text), response_validators(req)
+
+    def get_html(self, url) -> str:
+        return self.get_response(url).text
+
+    def get_response(self, url) -> requests.Response:
         logging.info("Getting content from URL: %s", url)
-        req = requests.get(url)
-        article = simple_json_from_html_string(req.text, use_readability=True)
-        text_list = [t["text"] for t in article["plain_text"]]
-        return text_list
+        req = self.session.get(url, timeout=self.timeout)
+        req.raise_for_status()
+        return req
+
+
+def response_validators(req: requests.Response) -> Dict[str, str]:
+    """The cache validators of a response, to make conditional requests later."""
+    validators = {
+        "etag": req.headers.get("ETag"),
+        "last_modified": req.headers.get("Last-Modified"),
+    }
+    return {name: value for name, value in validators.items() if value}
 
 
 class ChromeExtensionBypassPaywallParser(BaseParser):
-    def __init__(self, extention_path: str = "./extentions"):
+    def __init__(
+        self,
+        extention_path: str = "./extentions",
+        num_pages: int = PARSE_NUM_WORKERS,
+        max_navigations: int = BROWSER_MAX_NAVIGATIONS,
+        pool: BrowserPool = None,
+        extract_mode: str = EXTRACT_MODE,
+        page_timeout: float = None,
+    ):
+        super().__init__(extract_mode)
         self.extention_path = extention_path
         self.user_data_dir = "/tmp/test-user-data-dir"
+        self.pool = pool or BrowserPool(
+            num_pages=num_pages,
+            max_navigations=max_navigations,
+            headless=False,
+            user_data_dir=self.user_data_dir,
+            args=[
+                f"--disable-extensions-except={self.extention_path}",
+                f"--load-extension={self.extention_path}",
+            ],
+            page_timeout=page_timeout,
+        )
 
     def get_url_content(self, url) -> List[str]:
         """Get the content of a URL, return as a list of strings."""
-        with sync_playwright() as playwright:
-            context = playwright.chromium.launch_persistent_context(
-                self.user_data_dir,
-                headless=False,
-                args=[
-                    f"--disable-extensions-except={self.extention_path}",
-                    f"--load-extension={self.extention_path}",
-                ],
-            )
+        logging.info("Getting content from URL: %s", url)
+        return self.extract(self.pool.get_content(url))
 
-            page = context.new_page()
-            page.goto(url)
-            readable = simple_json_from_html_string(
-                page.content(), use_readability=True
-            )
-            text_list = [t["text"] for t in readable["plain_text"]]
+    def close(self):
+        self.pool.close()
 
-            # Test the background page as you would any other page.
-            context.close()
-        return text_list
+    def __enter__(self):
+        self.pool.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class TieredParser(BaseParser):
+    """Parse with plain HTTP first, escalate to the browser only when needed.
+
+    A page is escalated when the request fails, when the extracted text is
+    too short, or when the page looks like a paywall or a JavaScript shell.
+    Domains that keep needing the browser are remembered across runs and sent
+    to it directly, until their rule is older than `PARSER_RULES_TTL` and
+    plain HTTP is tried once more.
+    """
+
+    def __init__(
+        self,
+        http_parser: SimpleParser,
+        browser_parser: BaseParser,
+        rules_path: str = PARSER_RULES_PATH,
+        min_chars: int = EXTRACT_MIN_CHARS,
+    ):
+        super().__init__(http_parser.extract_mode)
+        self.http_parser = http_parser
+        self.browser_parser = browser_parser
+        self.rules_path = rules_path
+        self.min_chars = min_chars
+        self._lock = threading.Lock()
+        # domain -> {"escalations": in a row, "updated": time of the last one}
+        self.rules = {}
+        if os.path.exists(rules_path):
+            with open(rules_path) as f:
+                for domain, rule in json.load(f).items():
+                    if isinstance(rule, int):
+                        # Older files kept a bare count, treat it as expired.
+                        rule = {"escalations": rule, "updated": 0}
+                    self.rules[domain] = rule
+
+    def get_url_content(self, url) -> List[str]:
+        """Get the content of a URL, return as a list of strings."""
+        return self.get_url_page(url)[0]
+
+    def get_url_page(self, url) -> Tuple[List[str], Dict[str, str]]:
+        domain = urlparse(url).netloc
+        if self._needs_browser(domain):
+            logging.info("Domain needs the browser, skipping plain HTTP: %s", domain)
+            METRICS.incr("parser_browser")
+            return self.browser_parser.get_url_page(url)
+
+        reason = None
+        try:
+            req = self.http_parser.get_response(url)
+        except requests.RequestException as e:
+            reason = repr(e)
+        else:
+            html = req.text
+            # Decide on the fast extraction, readability is slow to run on
+            # pages that go to the browser anyway.
+            text_list = extract_text_list(html)
+            text = " ".join(text_list)
+            if len(text) < self.min_chars:
+                reason = "too little text"
+            elif len(text) < BLOCKED_CHECK_MAX_CHARS and BLOCKED_PATTERN.search(text):
+                reason = "looks blocked"
+        if reason is None:
+            self._record(domain, escalated=False)
+            METRICS.incr("parser_http")
+            return self.http_parser.extract(html, text_list), response_validators(req)
+
+        logging.info("Escalating to the browser (%s): %s", reason, url)
+        self._record(domain, escalated=True)
+        METRICS.incr("parser_browser")
+        return self.browser_parser.get_url_page(url)
+
+    def close(self):
+        self._save()
+        if hasattr(self.browser_parser, "close"):
+            self.browser_parser.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _needs_browser(self, domain: str) -> bool:
+        with self._lock:
+            rule = self.rules.get(domain)
+        return (
+            rule is not None
+            and rule["escalations"] >= PARSER_RULES_MIN_ESCALATIONS
+            and time.time() - rule["updated"] < PARSER_RULES_TTL
+        )
+
+    def _record(self, domain: str, escalated: bool):
+        with self._lock:
+            if escalated:
+                rule = self.rules.get(domain, {"escalations": 0})
+                self.rules[domain] = {
+                    "escalations": rule["escalations"] + 1,
+                    "updated": time.time(),
+                }
+            else:
+                self.rules.pop(domain, None)
+
+    def _save(self):
+        with self._lock:
+            rules = dict(self.rules)
+        parent = os.path.dirname(self.rules_path) or "."
+        os.makedirs(parent, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(rules, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.rules_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise